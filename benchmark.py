@@ -0,0 +1,256 @@
+"""
+Headless benchmarks for the voxel and physics hot paths.
+
+    python benchmark.py --output results.json
+    python benchmark.py --baseline results.json --threshold 0.15
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import pyglet
+
+pyglet.options['headless'] = True
+pyglet.options['shadow_window'] = False
+
+import numpy as np  # noqa: E402
+import pymunk  # noqa: E402
+
+from voxels.palette import EMPTY  # noqa: E402
+from voxels.voxel import VOXEL_SIZE, DiamondVoxel, DirtVoxel, IronVoxel, MarbleVoxel  # noqa: E402
+
+VOXELS = {DirtVoxel: 1.0, MarbleVoxel: 0.1, IronVoxel: 0.06, DiamondVoxel: 0.001}
+
+BENCHMARKS = []
+
+
+def benchmark(name, **params):
+    """Register a benchmark. The decorated function does its setup and returns the callable to time."""
+    def register(setup):
+        BENCHMARKS.append((name, setup, params))
+        return setup
+    return register
+
+
+def drain(terrain):
+    """Rebuild every grid the terrain's scheduler has queued, ignoring the frame budget"""
+    terrain.scheduler.flush()
+
+
+def build_all(terrain):
+    """Create and build every chunk of a VoxelMap, which otherwise only builds chunks as they are approached"""
+    terrain.warm_up(terrain.width // 2, terrain.height // 2, max(terrain.width, terrain.height))
+
+
+def terrain_state(width, height, seed=1):
+    from voxels.perlin import NoiseGenerator, generate_random_map
+    return generate_random_map(width, height, VOXELS, noise=NoiseGenerator(seed=seed))
+
+
+for size in (64, 256, 1024):
+    @benchmark("perlin_{}".format(size), size=size)
+    def bench_perlin(size):
+        from voxels.perlin import perlin
+        lin = np.linspace(0, 5, size, endpoint=False)
+        x, y = np.meshgrid(lin, lin)
+        return lambda: perlin(x, y, seed=1)
+
+for size in (32, 128, 512):
+    @benchmark("generate_random_map_{}".format(size), size=size)
+    def bench_generate(size):
+        from voxels.perlin import NoiseGenerator, generate_random_map
+        noise = NoiseGenerator(seed=1, octaves=3)
+        return lambda: generate_random_map(size, size, VOXELS, noise=noise)
+
+
+@benchmark("voxel_map_build_128", size=128)
+def bench_map_build(size):
+    from voxels.map import VoxelMap
+    state = terrain_state(size, size)
+
+    def run():
+        terrain = VoxelMap(state.copy(), pymunk.Space())
+        build_all(terrain)
+        terrain.close()
+    return run
+
+
+for size in (128, 1024):
+    @benchmark("voxel_map_startup_{}".format(size), size=size, radius=16)
+    def bench_map_startup(size, radius):
+        from voxels.map import VoxelMap
+        state = terrain_state(size, size)
+
+        def run():
+            # time to first frame: the chunk index plus the chunks around the spawn point
+            terrain = VoxelMap(state, pymunk.Space())
+            terrain.warm_up(size // 2, size // 2, radius)
+            terrain.close()
+        return run
+
+
+@benchmark("rebuild_single_edit")
+def bench_single_edit():
+    from voxels.map import VoxelMap
+    terrain = VoxelMap(terrain_state(64, 64), pymunk.Space(), collision_radius=None)
+    build_all(terrain)
+    values = [EMPTY, DirtVoxel]
+
+    def run():
+        values.reverse()
+        terrain[20, 20] = values[0]
+        drain(terrain)
+    return run
+
+
+@benchmark("rebuild_bulk_edit", radius=12)
+def bench_bulk_edit(radius):
+    from voxels.map import VoxelMap
+    terrain = VoxelMap(terrain_state(64, 64), pymunk.Space(), collision_radius=None)
+    build_all(terrain)
+    values = [EMPTY, DirtVoxel]
+
+    def run():
+        values.reverse()
+        terrain.fill_circle(32, 32, radius, values[0])
+        drain(terrain)
+    return run
+
+
+@benchmark("store_cycle", chunks=16, grid_size=32)
+def bench_store(chunks, grid_size):
+    from voxels.store import VoxelGridStore
+
+    def run():
+        with tempfile.TemporaryDirectory() as state_dir:
+            store = VoxelGridStore(pymunk.Space(), state_dir=state_dir, grid_width=grid_size, grid_height=grid_size,
+                                   known_voxels=VOXELS, seed=1, capacity=chunks // 2)
+            # first pass generates and saves every chunk, the second loads them back from disk; the small
+            # capacity evicts (and releases) half of them along the way
+            for _ in range(2):
+                for i in range(chunks):
+                    store[i * grid_size, 0].modified = True
+                    drain(store)
+            store.close()
+    return run
+
+
+for count in (50, 200):
+    @benchmark("stage_act_{}_boulders".format(count), boulders=count, ticks=60)
+    def bench_stage(boulders, ticks):
+        from bubblestash.actor import Actor
+        from bubblestash.stage import Stage
+        from voxels.map import VoxelMap
+
+        image = pyglet.resource.image("data/images/circle.png")
+        image.anchor_x = image.anchor_y = 32
+        stage = Stage()
+        stage.space.gravity = 0, -900
+        state = np.zeros((32, 128), dtype=np.uint8)
+        state[:8] = 1
+        # nothing here calls update_collision, so the whole map is solid
+        terrain = VoxelMap(state, stage.space, collision_radius=None)
+        build_all(terrain)
+        rng = np.random.RandomState(1)
+        for x, y in rng.uniform((2 * VOXEL_SIZE, 10 * VOXEL_SIZE), (126 * VOXEL_SIZE, 30 * VOXEL_SIZE), (boulders, 2)):
+            body = pymunk.Body(mass=2, moment=10000)
+            shape = pymunk.Circle(body, radius=30)
+            shape.friction = .8
+            stage.add_actor(Actor(body, shape, x=x, y=y, img=image))
+        # let the pile settle so the timed steps measure resting contacts rather than free fall
+        for _ in range(120):
+            stage.act(1 / 60.)
+
+        def run():
+            for _ in range(ticks):
+                stage.act(1 / 60.)
+        return run
+
+
+def time_benchmark(setup, params, repeat):
+    run = setup(**params)
+    run()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        "params": params,
+        "runs": repeat,
+        "min_ms": min(samples),
+        "median_ms": statistics.median(samples),
+        "mean_ms": statistics.mean(samples),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Print each benchmark's median against the baseline; returns the names that regressed"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print("{:<28} {:>10.3f} ms   (new)".format(name, result["median_ms"]))
+            continue
+        ratio = result["median_ms"] / base["median_ms"]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print("{:<28} {:>10.3f} ms   baseline {:>10.3f} ms   x{:.2f}{}".format(
+            name, result["median_ms"], base["median_ms"], ratio, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown before failing")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--filter", default="", help="only run benchmarks whose name contains this")
+    args = parser.parse_args(argv)
+
+    pyglet.resource.path = [sys.path[0] or "."]
+    pyglet.resource.reindex()
+    # sprites and vertex lists need a GL context even though nothing is ever shown
+    window = pyglet.window.Window(width=64, height=64, visible=False)
+
+    results = {}
+    for name, setup, params in BENCHMARKS:
+        if args.filter in name:
+            results[name] = time_benchmark(setup, params, args.repeat)
+            if not args.baseline:
+                print("{:<28} {:>10.3f} ms".format(name, results[name]["median_ms"]))
+    window.close()
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)["results"], args.threshold)
+
+    if args.output:
+        report = {
+            "meta": {
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "numpy": np.__version__,
+                "pyglet": pyglet.version,
+                "pymunk": pymunk.version,
+                "repeat": args.repeat,
+            },
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
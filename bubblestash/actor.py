@@ -1,16 +1,80 @@
+import math
+
 import pyglet
 
 
 class Actor(pyglet.sprite.Sprite):
+    # the Stage syncing this actor's quad in bulk, and its row in that stage's poses
+    _stage = None
+    _pose_index = None
+
     def __init__(self, body, shape, x=0, y=0, *args, **kwargs):
         super().__init__(x=x, y=y, *args, **kwargs)
         self.body = body
         self.body.position = x, y
         self.shape = shape
+        self.save_pose()
         # self.shape.actor = self
 
+    def save_pose(self):
+        """Remember the body's pose before a physics tick, to interpolate the sprite from"""
+        self._previous_position = self.body.position
+        self._previous_angle = self.body.angle
+
     def act(self, dt):
         self.update(
             x=self.body.position.x,
             y=self.body.position.y,
             rotation=-self.body.rotation_vector.angle_degrees)
+
+    def interpolate(self, alpha):
+        """Place the sprite `alpha` of the way from the pose before the last tick to the body's current one"""
+        (x0, y0), (x1, y1) = self._previous_position, self.body.position
+        angle = self._previous_angle + (self.body.angle - self._previous_angle) * alpha
+        self.update(
+            x=x0 + (x1 - x0) * alpha,
+            y=y0 + (y1 - y0) * alpha,
+            rotation=-math.degrees(angle))
+
+    def _drawn_pose(self):
+        if self._stage is None:
+            return self._x, self._y, self._rotation
+        x, y, angle = self._stage.drawn_poses[self._pose_index]
+        return float(x), float(y), -math.degrees(angle)
+
+    # a bulk-synced sprite's quad is written by its stage, so its position is read back from there
+
+    @pyglet.sprite.Sprite.x.getter
+    def x(self):
+        return self._drawn_pose()[0]
+
+    @pyglet.sprite.Sprite.y.getter
+    def y(self):
+        return self._drawn_pose()[1]
+
+    @pyglet.sprite.Sprite.rotation.getter
+    def rotation(self):
+        return self._drawn_pose()[2]
+
+    @pyglet.sprite.Sprite.position.getter
+    def position(self):
+        return self._drawn_pose()[:2]
+
+    # and any change to its quad's shape or place in the batch has to be picked up by the stage
+
+    def _update_position(self):
+        super()._update_position()
+        if self._stage is not None:
+            self._stage.invalidate_layout()
+
+    @pyglet.sprite.Sprite.batch.setter
+    def batch(self, batch):
+        pyglet.sprite.Sprite.batch.fset(self, batch)
+        if self._stage is not None:
+            self._stage.invalidate_layout()
+
+    @pyglet.sprite.Sprite.group.setter
+    def group(self, group):
+        pyglet.sprite.Sprite.group.fset(self, group)
+        if self._stage is not None:
+            self._stage.invalidate_layout()
@@ -36,6 +36,9 @@ class Camera(object):
 
         return np.array([scaled_left, scaled_right, scaled_bottom, scaled_top])
 
+    def center(self):
+        return self.left + self.half_width, self.bottom + self.half_height
+
     def screen_to_world_coords(self, x, y):
         scaled_left, scaled_right, scaled_bottom, scaled_top = self.scaled_bounds()
         scaled_width = scaled_right - scaled_left
@@ -0,0 +1,171 @@
+import time
+
+import numpy as np
+import pyglet
+from pyglet import gl
+
+
+class _NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class _Phase(object):
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        stack = self.profiler._stack
+        self.start = time.perf_counter()
+        if stack:
+            # the enclosing phase stops counting while this one runs
+            stack[-1]._charge(self.start)
+        stack.append(self)
+        return self
+
+    def __exit__(self, *exc):
+        stack = self.profiler._stack
+        now = time.perf_counter()
+        self._charge(now)
+        stack.pop()
+        if stack:
+            stack[-1].start = now
+        return False
+
+    def _charge(self, now):
+        frame = self.profiler._frame
+        frame[self.name] = frame.get(self.name, 0.) + now - self.start
+
+
+class FrameProfiler(object):
+    """Per-frame phase times and counters over the last `capacity` frames; nested phases are timed exclusively"""
+
+    def __init__(self, capacity=300, enabled=False):
+        self.capacity = capacity
+        self.enabled = enabled
+        self.frames = 0
+        self._frame = {}
+        self._frame_start = None
+        self._samples = {}
+        self._stack = []
+        self._watches = {}
+        self.counters = set()
+
+    def phase(self, name):
+        if not self.enabled:
+            return _NULL_PHASE
+        return _Phase(self, name)
+
+    def add(self, name, value=1):
+        if self.enabled:
+            self.counters.add(name)
+            self._frame[name] = self._frame.get(name, 0) + value
+
+    def watch(self, name, sample):
+        """Record `sample()` under `name` at the end of every profiled frame"""
+        self.counters.add(name)
+        self._watches[name] = sample
+
+    def end_frame(self):
+        """Close the current frame: store its phase times and counters and start the next one"""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        frame, self._frame = self._frame, {}
+        if self._frame_start is not None:
+            frame["frame"] = now - self._frame_start
+        self._frame_start = now
+        for name, sample in self._watches.items():
+            frame[name] = sample()
+
+        index = self.frames % self.capacity
+        for name, value in frame.items():
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = np.full(self.capacity, np.nan)
+            samples[index] = value
+        # anything absent this frame (a phase that didn't run, a counter never bumped) was zero
+        for name, samples in self._samples.items():
+            if name not in frame:
+                samples[index] = 0
+        self.frames += 1
+
+    def reset(self):
+        self.frames = 0
+        self._frame = {}
+        self._frame_start = None
+        self._samples = {}
+
+    def last(self, name):
+        if not self.frames or name not in self._samples:
+            return None
+        return self._samples[name][(self.frames - 1) % self.capacity]
+
+    def stats(self):
+        """{name: {"last", "mean", "p50", "p95", "p99", "max"}} over the buffered frames, phases in seconds"""
+        result = {}
+        for name, samples in self._samples.items():
+            values = samples[~np.isnan(samples)]
+            if not len(values):
+                continue
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            result[name] = {"last": float(self.last(name)), "mean": float(values.mean()), "p50": float(p50),
+                            "p95": float(p95), "p99": float(p99), "max": float(values.max())}
+        return result
+
+
+# shared instance the engine and voxel code report into; switch it on with `profiler.enabled = True`
+profiler = FrameProfiler()
+
+
+class ProfilerOverlay(object):
+    """Text readout of a FrameProfiler in window pixels, re-laid out at most every `interval` seconds"""
+
+    def __init__(self, window, profiler=profiler, interval=0.25, font_size=10):
+        self.window = window
+        self.profiler = profiler
+        self.interval = interval
+        self._last_layout = 0
+        self.label = pyglet.text.Label("", font_name=("Courier New", "DejaVu Sans Mono"), font_size=font_size,
+                                       multiline=True, width=window.width,
+                                       x=8, y=window.height - 8, anchor_x='left', anchor_y='top',
+                                       color=(255, 255, 255, 255))
+
+    def format(self):
+        lines = ["{:<13} {:>7} {:>7} {:>7}".format("ms", "p50", "p95", "p99")]
+        counters = []
+        for name, stats in sorted(self.profiler.stats().items()):
+            if name in self.profiler.counters:
+                counters.append("{} {:d}".format(name, int(stats["last"])))
+            else:
+                lines.append("{:<13} {:>7.2f} {:>7.2f} {:>7.2f}".format(
+                    name, stats["p50"] * 1000, stats["p95"] * 1000, stats["p99"] * 1000))
+        return "\n".join(lines + counters)
+
+    def draw(self):
+        if not self.profiler.enabled:
+            return
+        now = time.perf_counter()
+        if now - self._last_layout >= self.interval:
+            self._last_layout = now
+            self.label.y = self.window.height - 8
+            self.label.text = self.format()
+
+        gl.glMatrixMode(gl.GL_PROJECTION)
+        gl.glPushMatrix()
+        gl.glLoadIdentity()
+        gl.glOrtho(0, self.window.width, 0, self.window.height, -1, 1)
+        gl.glMatrixMode(gl.GL_MODELVIEW)
+        self.label.draw()
+        gl.glMatrixMode(gl.GL_PROJECTION)
+        gl.glPopMatrix()
+        gl.glMatrixMode(gl.GL_MODELVIEW)
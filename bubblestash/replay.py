@@ -0,0 +1,58 @@
+"""Input recorded by stage tick and replayed one tick at a time, so replays don't depend on frame rate"""
+import time
+
+import numpy as np
+
+FORMAT_VERSION = 1
+
+KEY_PRESS = 0
+KEY_RELEASE = 1
+# kinds from here up are free for the game to define (terrain edits, spawns, ...)
+CUSTOM = 16
+
+EVENT_DTYPE = np.dtype([("tick", "<u4"), ("time", "<f4"), ("kind", "u1"), ("args", "<i4", (3,))])
+
+
+class InputRecorder(object):
+
+    def __init__(self, stage, **meta):
+        if not stage.tick_rate:
+            raise ValueError("input can only be recorded against a fixed-timestep Stage")
+        self.stage = stage
+        self.meta = meta
+        self._events = []
+        self._start = time.perf_counter()
+
+    def record(self, kind, *args):
+        """Record an event (up to three ints) to be replayed before the stage's next tick"""
+        args = tuple(int(arg) for arg in args) + (0,) * (3 - len(args))
+        self._events.append((self.stage.tick_count, time.perf_counter() - self._start, kind, args))
+
+    def on_key_press(self, symbol, modifiers):
+        self.record(KEY_PRESS, symbol, modifiers)
+
+    def on_key_release(self, symbol, modifiers):
+        self.record(KEY_RELEASE, symbol, modifiers)
+
+    def save(self, filename):
+        meta = dict(self.meta, version=FORMAT_VERSION, tick_rate=self.stage.tick_rate, ticks=self.stage.tick_count)
+        with open(filename, "wb") as f:
+            np.savez_compressed(f, events=np.array(self._events, dtype=EVENT_DTYPE),
+                                **{"meta_" + name: value for name, value in meta.items()})
+
+
+class InputReplay(object):
+
+    def __init__(self, filename):
+        with np.load(filename) as data:
+            self.events = data["events"]
+            self.meta = {name[5:]: data[name].item() for name in data.files if name.startswith("meta_")}
+        if self.meta.get("version") != FORMAT_VERSION:
+            raise ValueError("unsupported replay version {!r} in {}".format(self.meta.get("version"), filename))
+        self.ticks = self.meta["ticks"]
+        self._bounds = np.searchsorted(self.events["tick"], np.arange(self.ticks + 1))
+
+    def events_at(self, tick):
+        """(kind, args) of the events recorded before `tick`, in the order they happened"""
+        events = self.events[self._bounds[tick]:self._bounds[tick + 1]] if tick < self.ticks else ()
+        return [(int(event["kind"]), event["args"].tolist()) for event in events]
@@ -1,28 +1,170 @@
+import numpy as np
 import pyglet
 import pymunk
 
+from bubblestash.actor import Actor
+from bubblestash.profiler import profiler
+
+
+def _is_plain(actor):
+    """Actors without their own act/interpolate logic only mirror their body, so they can be synced in bulk"""
+    return type(actor).act is Actor.act and type(actor).interpolate is Actor.interpolate
+
 
 class Stage(object):
+    """Actors and their physics space, stepped in fixed ticks with interpolated drawing when given a `tick_rate`"""
 
-    def __init__(self):
+    def __init__(self, tick_rate=None, max_substeps=5):
         self.space = pymunk.Space()
         self.actors = []
         self._batch = pyglet.graphics.Batch()
+        self.tick_rate = tick_rate
+        self.max_substeps = max_substeps
+        self.ticks = 0
+        self.tick_count = 0
+        self.alpha = 1.
+        self._accumulator = 0.
+        self._tick_callbacks = []
+
+        self._custom = []
+        # actors without their own act/interpolate have their quads written in bulk from `poses`
+        self._plain = []
+        self._layout = None
+        self.poses = np.zeros((0, 3))
+        self._previous_poses = self.poses
+        self.drawn_poses = self.poses
+
+    def add_tick_callback(self, func):
+        """Call `func()` before every physics step"""
+        self._tick_callbacks.append(func)
 
     def add_actor(self, actor: pyglet.sprite.Sprite):
         actor.batch = self._batch
         self.space.add(actor.body, actor.shape)
+        actor.save_pose()
         self.actors.append(actor)
+        if _is_plain(actor):
+            self._plain.append(actor)
+            actor._stage = self
+            self.refresh()
+        else:
+            self._custom.append(actor)
 
     def remove_actor(self, actor):
         self.space.remove(actor.body, actor.shape)
         self.actors.remove(actor)
+        if actor in self._plain:
+            self._plain.remove(actor)
+            actor._stage = actor._pose_index = None
+            actor.act(0)
+            self.refresh()
+        else:
+            self._custom.remove(actor)
+
+    def refresh(self):
+        """Re-gather the bulk-synced actors' poses and re-read their quads on the next sync"""
+        for i, actor in enumerate(self._plain):
+            actor._pose_index = i
+        self._layout = None
+        self.poses = self._gather()
+        self._previous_poses = self.poses
+        self.drawn_poses = self.poses
+
+    def invalidate_layout(self):
+        """Re-read the bulk-synced actors' quads and vertex list positions before they are next drawn"""
+        self._layout = None
+
+    def _gather(self):
+        return np.array([(*actor.body.position, actor.body.angle) for actor in self._plain]).reshape(-1, 3)
+
+    def _get_layout(self):
+        if self._layout is None:
+            corners = np.zeros((len(self._plain), 4, 2))
+            domains = {}
+            for i, actor in enumerate(self._plain):
+                image = actor._texture
+                if actor.visible:
+                    x1 = -image.anchor_x * actor.scale * actor.scale_x
+                    y1 = -image.anchor_y * actor.scale * actor.scale_y
+                    x2 = x1 + image.width * actor.scale * actor.scale_x
+                    y2 = y1 + image.height * actor.scale * actor.scale_y
+                    corners[i] = (x1, y1), (x2, y1), (x2, y2), (x1, y2)
+                vertex_list = actor._vertex_list
+                rows, starts, _ = domains.setdefault(id(vertex_list.domain), ([], [], vertex_list.domain))
+                rows.append(i)
+                starts.append(vertex_list.start)
+            self._layout = corners, [(np.array(rows), np.array(starts), domain)
+                                     for rows, starts, domain in domains.values()]
+        return self._layout
+
+    def _write_vertices(self, poses):
+        """Write the bulk-synced sprites' quads for (N, 3) `poses` straight into their vertex buffers"""
+        self.drawn_poses = poses
+        if not len(poses):
+            return
+        corners, domains = self._get_layout()
+        cos, sin = np.cos(poses[:, 2])[:, None], np.sin(poses[:, 2])[:, None]
+        vertices = np.empty((len(poses), 4, 2))
+        vertices[:, :, 0] = corners[:, :, 0] * cos - corners[:, :, 1] * sin + poses[:, :1]
+        vertices[:, :, 1] = corners[:, :, 0] * sin + corners[:, :, 1] * cos + poses[:, 1:2]
+        vertices[~corners.any(axis=(1, 2))] = 0
+
+        for rows, starts, domain in domains:
+            attribute = domain.attribute_names['vertices']
+            first, last = int(starts.min()), int(starts.max()) + 4
+            region = attribute.get_region(attribute.buffer, first, last - first)
+            array = np.ctypeslib.as_array(region.array)
+            quads = vertices[rows].reshape(-1, 8)
+            array[(starts - first)[:, None] * 2 + np.arange(8)] = quads if array.dtype.kind == 'f' else np.trunc(quads)
+            region.invalidate()
 
     def act(self, dt):
-        self.space.step(dt)
-        for actor in self.actors:
-            actor.act(dt)
+        with profiler.phase("physics"):
+            self._act(dt)
 
-    def draw(self):
-        self._batch.draw()
+    def _act(self, dt):
+        if not self.tick_rate:
+            for func in self._tick_callbacks:
+                func()
+            self.space.step(dt)
+            self.poses = self._gather()
+            self._write_vertices(self.poses)
+            for actor in self._custom:
+                actor.act(dt)
+            self.tick_count += 1
+            return
 
+        step = 1. / self.tick_rate
+        # ticks are counted up front: subtracting steps until the accumulator runs short can lose one to rounding
+        ticks = int((self._accumulator + dt) * self.tick_rate + 1e-9)
+        if ticks >= self.max_substeps:
+            # a long frame runs max_substeps ticks and drops the rest of its time
+            ticks = self.max_substeps
+            self._accumulator = 0.
+        else:
+            self._accumulator = max(self._accumulator + dt - ticks * step, 0.)
+        self.ticks = 0
+        for _ in range(ticks):
+            for func in self._tick_callbacks:
+                func()
+            for actor in self._custom:
+                actor.save_pose()
+            self._previous_poses = self.poses
+            self.space.step(step)
+            self.poses = self._gather()
+            for actor in self._custom:
+                actor.act(step)
+            self.ticks += 1
+            self.tick_count += 1
+
+        self.alpha = self._accumulator / step
+        self._write_vertices(self._previous_poses + (self.poses - self._previous_poses) * self.alpha)
+        for actor in self._custom:
+            actor.interpolate(self.alpha)
+
+    def draw(self):
+        with profiler.phase("draw_actors"):
+            if self._layout is None:
+                # a sprite changed since the last sync and drew its quad where it last stood on its own
+                self._write_vertices(self.drawn_poses)
+            self._batch.draw()
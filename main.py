@@ -6,7 +6,7 @@ from bubblestash import actor, controls
 from bubblestash.camera import Camera
 from bubblestash.stage import Stage
 from bubblestash.window import GameWindow
-from quote import SpeechBubble
+from quote import SpeechBubbles
 
 
 class CollisionTypes(object):
@@ -136,9 +136,9 @@ if __name__ == "__main__":
 
     camera = Camera(0, 0, 1280, 720)
     camera.init_gl()
-    window = GameWindow(width=1280, height=720, camera=camera)
+    window = GameWindow(width=1280, height=720, camera=camera, vsync=True)
 
-    stage = Stage()
+    stage = Stage(tick_rate=120)
     stage.space.gravity = 0, -900
 
     sign = Sign(x=632, y=295)
@@ -152,16 +152,19 @@ if __name__ == "__main__":
     stage.add_actor(player)
 
     props = []
+    bubbles = SpeechBubbles()
 
 
     def pre_solve(arbiter, space, data):
         if arbiter.is_first_contact:
-            bubble = SpeechBubble(650, 360, "This sign has important things to say!")
+            bubble = bubbles.show(650, 360, "This sign has important things to say!")
             props.append(bubble)
         return False
 
 
     def separate(arbiter, space, data):
+        for bubble in props:
+            bubble.hide()
         del props[::]
 
 
@@ -212,11 +215,15 @@ if __name__ == "__main__":
     def update(dt):
         stage.act(dt)
         camera.look_at(player)
+
+
+    @window.event
+    def on_draw():
         window.clear()
         stage.draw()
-        for prop in props:
-            prop.draw()
+        bubbles.draw()
 
 
-    pyglet.clock.schedule_interval(update, 1 / 144.0)
+    # physics ticks at a fixed rate inside stage.act; drawing follows the display's refresh rate
+    pyglet.clock.schedule(update)
     pyglet.app.run()
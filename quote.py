@@ -1,66 +1,123 @@
 import pyglet
 from pyglet import font
 from pyglet.gl import glEnable, glBindTexture, glPushAttrib, GL_COLOR_BUFFER_BIT, GL_BLEND, glTexParameteri, \
-    GL_TEXTURE_MAG_FILTER, GL_NEAREST
+    GL_TEXTURE_MAG_FILTER, GL_TEXTURE_MIN_FILTER, GL_NEAREST, GL_QUADS
 from pyglet.text import Label
 
 font.add_file("./data/fonts/PressStart2P-Regular.ttf")
 
 
-class SpeechBubble(object):
+BUBBLE_IMAGE_DIR = "./data/images/text_bubble/"
+BUBBLE_PIECES = ("bottom", "bottom_left", "bottom_right", "left", "right", "top", "top_left", "top_right",
+                 "white_pixel")
+MAX_LENGTH = 450
+
+
+class BubbleAtlas(object):
+    """The nine bubble images, loaded from disk once and packed into a single texture"""
+    _instance = None
+
+    def __init__(self):
+        self.atlas = pyglet.image.atlas.TextureAtlas(width=128, height=128)
+        self.regions = {name: self.atlas.add(pyglet.image.load(BUBBLE_IMAGE_DIR + name + ".png"), border=1)
+                        for name in BUBBLE_PIECES}
+        self.texture = self.atlas.texture
+        # edges and the centre are stretched from 1-4 pixel strips, so never blend in their neighbours
+        glBindTexture(self.texture.target, self.texture.id)
+        glTexParameteri(self.texture.target, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glTexParameteri(self.texture.target, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
 
-    def __init__(self, x, y, message):
-        image_paths = [
-            "./data/images/text_bubble/bottom.png",
-            "./data/images/text_bubble/bottom_left.png",
-            "./data/images/text_bubble/bottom_right.png",
-            "./data/images/text_bubble/left.png",
-            "./data/images/text_bubble/right.png",
-            "./data/images/text_bubble/top.png",
-            "./data/images/text_bubble/top_left.png",
-            "./data/images/text_bubble/top_right.png",
-            "./data/images/text_bubble/white_pixel.png"
-        ]
-        b, bl, br, l, r, t, tl, tr, wp = map(pyglet.image.load, image_paths)
-
-        max_length = 450
-        width = min(len(message) * 18, max_length)
-        height = 20 * (len(message) * 22 // max_length + 1)
-
-        self.label = Label(text=message, font_name='Press Start 2P', font_size=14, x=x + 40, y=y + 40,
-                           color=(0, 0, 0, 255), width=max_length, height=height, multiline=(height > 1),
-                           anchor_x='left', anchor_y='bottom')
-
-        self.top_left = pyglet.sprite.Sprite(img=tl, x=x + 0, y=y + 40 + height)
-        self.bottom_left = pyglet.sprite.Sprite(img=bl, x=x + 0, y=y + 0)
-
-        self.top = pyglet.sprite.Sprite(img=t, x=x + 40, y=y + 40 + height)
-        self.top.update(scale_x=width / 4)
-        self.bottom = pyglet.sprite.Sprite(img=b, x=x + 40, y=y + 0)
-        self.bottom.update(scale_x=width / 4)
-
-        self.top_right = pyglet.sprite.Sprite(img=tr, x=x + 40 + width, y=y + 40 + height)
-        self.bottom_right = pyglet.sprite.Sprite(img=br, x=x + 40 + width, y=y + 0)
-
-        self.right = pyglet.sprite.Sprite(img=r, x=x + 40 + width, y=y + 40)
-        self.right.update(scale_y=height / 4)
-        self.left = pyglet.sprite.Sprite(img=l, x=x + 0, y=y + 40)
-        self.left.update(scale_y=height / 4)
-
-        self.white_pixel = pyglet.sprite.Sprite(img=wp, x=x + 40, y=y + 40)
-        self.white_pixel.update(scale_x=width, scale_y=height)
+    @classmethod
+    def get(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+
+class SpeechBubble(object):
+    """One nine-patch bubble and its label; get them from `SpeechBubbles.show` and give them back with `hide`"""
+
+    def __init__(self, bubbles):
+        self.bubbles = bubbles
+        self.message = None
+        self.label = None
+        tex_coords = [coord for name in BUBBLE_PIECES for coord in bubbles.atlas.regions[name].tex_coords]
+        self.vertex_list = bubbles.batch.add(4 * len(BUBBLE_PIECES), GL_QUADS, bubbles.patch_group,
+                                             ('v2f', [0.] * 8 * len(BUBBLE_PIECES)), ('t3f', tex_coords))
+
+    def place(self, x, y, message):
+        regions = self.bubbles.atlas.regions
+        width, height = bubble_size(message)
+        left, bottom = regions["bottom_left"].width, regions["bottom_left"].height
+        right, top = x + left + width, y + bottom + height
+        quads = {
+            "bottom": (x + left, y, width, bottom),
+            "bottom_left": (x, y, left, bottom),
+            "bottom_right": (right, y, regions["bottom_right"].width, bottom),
+            "left": (x, y + bottom, left, height),
+            "right": (right, y + bottom, regions["right"].width, height),
+            "top": (x + left, top, width, regions["top"].height),
+            "top_left": (x, top, left, regions["top_left"].height),
+            "top_right": (right, top, regions["top_right"].width, regions["top_right"].height),
+            "white_pixel": (x + left, y + bottom, width, height),
+        }
+        vertices = []
+        for name in BUBBLE_PIECES:
+            x0, y0, w, h = quads[name]
+            vertices.extend((x0, y0, x0 + w, y0, x0 + w, y0 + h, x0, y0 + h))
+        self.vertex_list.vertices[:] = vertices
+        self.message = message
+        self.label = self.bubbles.take_label(message, x + left, y + bottom)
+
+    def hide(self):
+        self.bubbles.release(self)
+
+
+def bubble_size(message):
+    width = min(len(message) * 18, MAX_LENGTH)
+    height = 20 * (len(message) * 22 // MAX_LENGTH + 1)
+    return width, height
+
+
+class SpeechBubbles(object):
+    """Pooled speech bubbles drawn from one shared batch, with images and labels loaded once"""
+
+    def __init__(self, batch=None):
+        self.batch = batch or pyglet.graphics.Batch()
+        self.atlas = BubbleAtlas.get()
+        self.patch_group = pyglet.graphics.TextureGroup(self.atlas.texture, parent=pyglet.graphics.OrderedGroup(0))
+        self.label_group = pyglet.graphics.OrderedGroup(1)
+        self._free = []
+        self._labels = {}
+
+    def show(self, x, y, message):
+        bubble = self._free.pop() if self._free else SpeechBubble(self)
+        bubble.place(x, y, message)
+        return bubble
+
+    def release(self, bubble):
+        if bubble.label is None:
+            return
+        bubble.vertex_list.vertices[:] = [0.] * len(bubble.vertex_list.vertices)
+        bubble.label.visible = False
+        self._labels.setdefault(bubble.message, []).append(bubble.label)
+        bubble.label = None
+        self._free.append(bubble)
+
+    def take_label(self, message, x, y):
+        labels = self._labels.get(message)
+        if labels:
+            label = labels.pop()
+            label.update(x, y)
+            label.visible = True
+            return label
+        width, height = bubble_size(message)
+        return Label(text=message, font_name='Press Start 2P', font_size=14, x=x, y=y,
+                     color=(0, 0, 0, 255), width=MAX_LENGTH, height=height, multiline=(height > 1),
+                     anchor_x='left', anchor_y='bottom', batch=self.batch, group=self.label_group)
 
     def draw(self):
-        self.bottom.draw()
-        self.bottom_left.draw()
-        self.bottom_right.draw()
-        self.left.draw()
-        self.right.draw()
-        self.top_right.draw()
-        self.top_left.draw()
-        self.top.draw()
-        self.white_pixel.draw()
-        self.label.draw()
+        self.batch.draw()
 
 
 if __name__ == "__main__":
@@ -77,20 +134,18 @@ if __name__ == "__main__":
 
     guy.update(scale_x=4, scale_y=4)
 
-    bubbles = [
-        # SpeechBubble(30, 350, "Hello, World!"),
-        # SpeechBubble(30, 260, "Wow this is a longer one!"),
-        # SpeechBubble(30, 170, "short!"),
-        SpeechBubble(80, 40, "Bananas")
-    ]
+    bubbles = SpeechBubbles()
+    # bubbles.show(30, 350, "Hello, World!")
+    # bubbles.show(30, 260, "Wow this is a longer one!")
+    # bubbles.show(30, 170, "short!")
+    bubbles.show(80, 40, "Bananas")
 
 
     @window.event
     def on_draw():
         window.clear()
         guy.draw()
-        for b in bubbles:
-            b.draw()
+        bubbles.draw()
 
 
     pyglet.app.run()
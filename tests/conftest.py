@@ -0,0 +1,18 @@
+import os
+
+import pyglet
+import pytest
+
+pyglet.options['headless'] = True
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+pyglet.resource.path = [ROOT]
+pyglet.resource.reindex()
+
+
+@pytest.fixture(scope="session", autouse=True)
+def gl_context():
+    # grids build sprites and textures, which need a current GL context
+    window = pyglet.window.Window(width=64, height=64, visible=False)
+    yield window
+    window.close()
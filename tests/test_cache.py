@@ -0,0 +1,92 @@
+import numpy as np
+import pymunk
+
+from voxels.cache import ChunkCache
+from voxels.palette import EMPTY, default_palette
+from voxels.store import VoxelGridStore
+from voxels.voxel import DirtVoxel
+
+
+def test_evicts_least_recently_used():
+    evicted = []
+    cache = ChunkCache(capacity=2, on_evict=lambda key, value: evicted.append(key))
+    cache["a"] = 1
+    cache["b"] = 2
+    cache.get("a")
+    cache["c"] = 3
+    assert evicted == ["b"]
+    assert list(cache) == ["a", "c"]
+    assert cache.stats()["evictions"] == 1
+
+
+def test_peek_does_not_refresh():
+    evicted = []
+    cache = ChunkCache(capacity=2, on_evict=lambda key, value: evicted.append(key))
+    cache["a"] = 1
+    cache["b"] = 2
+    cache.peek("a")
+    cache["c"] = 3
+    assert evicted == ["a"]
+
+
+def test_pinned_entries_overshoot_capacity():
+    cache = ChunkCache(capacity=1)
+    cache.pinned = {"a", "b"}
+    cache["a"] = 1
+    cache["b"] = 2
+    assert len(cache) == 2
+    cache.pinned = set()
+    cache.trim()
+    assert list(cache) == ["b"]
+
+
+def test_byte_budget():
+    cache = ChunkCache(max_bytes=10, sizeof=len)
+    cache["a"] = "x" * 6
+    cache["b"] = "x" * 6
+    assert list(cache) == ["b"]
+    assert cache.bytes == 6
+
+
+def test_store_writes_back_on_eviction(tmp_path):
+    store = VoxelGridStore(pymunk.Space(), state_dir=str(tmp_path), grid_width=8, grid_height=8,
+                           known_voxels={DirtVoxel: 0.5}, seed=1, capacity=1)
+    store.fill_rect(0, 0, 8, 8, DirtVoxel)
+    store.fill_rect(2, 2, 4, 4, EMPTY)
+    expected = store[0, 0].state.copy()
+    # loading another chunk pushes the edited one out
+    store[64, 64]
+    assert store.get_neighbor(0, 0) is None
+    np.testing.assert_array_equal(store._read_state(0, 0), expected)
+    assert store[0, 0].state[2, 2] == EMPTY
+    assert store[0, 0].state[0, 0] == default_palette().id_of(DirtVoxel)
+    store.close()
+
+
+def test_resize_remeasures_and_trims():
+    cache = ChunkCache(max_bytes=10, sizeof=len)
+    cache["a"] = []
+    cache["b"] = []
+    cache.peek("b").extend("x" * 12)
+    cache.resize("b")
+    # the entry that grew stays, even when it is over budget on its own
+    assert list(cache) == ["b"]
+    assert cache.bytes == 12
+
+
+def test_store_counts_edited_uniform_chunks(tmp_path):
+    store = VoxelGridStore(pymunk.Space(), state_dir=str(tmp_path), grid_width=8, grid_height=8,
+                           known_voxels={DirtVoxel: 0.5}, seed=1, capacity=None, max_bytes=200)
+    dirt = default_palette().id_of(DirtVoxel)
+    for i in range(5):
+        store[i * 8, 0] = np.full((8, 8), dirt, dtype=np.uint8)
+        # loaded uniform chunks share one read-only state
+        assert not store[i * 8, 0].state.flags.writeable
+    assert store.stats()["bytes"] == 0
+    for i in range(5):
+        store.fill_rect(i * 8 + 4, 4, i * 8 + 5, 5, EMPTY)
+    # each edit copied out a 64 byte state, so only the last three edited fit the budget
+    assert store.stats()["bytes"] == 192
+    assert list(store._cache) == [(16, 0), (24, 0), (32, 0)]
+    assert store._read_state(0, 0)[4, 4] == EMPTY
+    store.close()
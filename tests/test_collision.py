@@ -0,0 +1,65 @@
+import numpy as np
+
+from voxels.collision import chunk_segments, merge_segments
+
+
+def unit_steps(segments):
+    """(N, 4) unit steps along each segment's primitive direction, each step's lower endpoint first"""
+    segments = np.asarray(segments)
+    assert np.array_equal(segments, np.round(segments))
+    a, b = segments[:, :2].astype(np.int64), segments[:, 2:].astype(np.int64)
+    n = np.gcd(b[:, 0] - a[:, 0], b[:, 1] - a[:, 1])
+    d = (b - a) // n[:, None]
+    k = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+    start = np.repeat(a, n, axis=0) + k[:, None] * np.repeat(d, n, axis=0)
+    end = start + np.repeat(d, n, axis=0)
+    # the same step taken in either direction is the same piece of contour
+    backwards = (end[:, 0] < start[:, 0]) | ((end[:, 0] == start[:, 0]) & (end[:, 1] < start[:, 1]))
+    lower = np.where(backwards[:, None], end, start)
+    return np.hstack([lower, start + end - lower])
+
+
+def test_merged_segments_cover_exactly_the_raw_ones():
+    for seed in range(200):
+        shape_values = np.random.RandomState(seed).randint(0, 16, size=(8, 8))
+        raw = chunk_segments(shape_values)
+        merged = merge_segments(raw)
+        steps = unit_steps(merged)
+        # nothing covered twice, nothing added and nothing lost
+        assert len(np.unique(steps, axis=0)) == len(steps)
+        np.testing.assert_array_equal(np.unique(steps, axis=0), np.unique(unit_steps(raw), axis=0))
+        assert len(merged) <= len(raw)
+
+
+def test_merged_runs_are_maximal():
+    shape_values = np.random.RandomState(0).randint(0, 16, size=(8, 8))
+    merged = merge_segments(chunk_segments(shape_values))
+    ends = {}
+    for x0, y0, x1, y1 in merged.tolist():
+        d = np.array([x1 - x0, y1 - y0])
+        d = tuple(d / np.abs(d).max())
+        for point in ((x0, y0), (x1, y1)):
+            # two runs along the same direction never meet end to end
+            assert (point, d) not in ends
+            ends[point, d] = True
+
+
+def test_collinear_diagonal_runs():
+    segments = np.array([
+        [0, 0, 16, 16],
+        [16, 16, 32, 32],
+        # reversed and overlapping the previous one
+        [40, 40, 24, 24],
+        # same direction, separated by a gap
+        [48, 48, 64, 64],
+        # parallel, on another line
+        [0, 16, 16, 32],
+        # the other diagonal, crossing the first line
+        [0, 32, 32, 0],
+    ])
+    merged = sorted(map(tuple, merge_segments(segments).tolist()))
+    assert merged == [(0, 0, 40, 40), (0, 16, 16, 32), (0, 32, 32, 0), (48, 48, 64, 64)]
+
+
+def test_no_segments():
+    assert merge_segments(np.zeros((0, 4), dtype=np.int64)).shape == (0, 4)
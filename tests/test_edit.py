@@ -0,0 +1,58 @@
+import numpy as np
+import pymunk
+import pytest
+
+from voxels.map import VoxelMap
+from voxels.palette import EMPTY, default_palette
+from voxels.voxel import DirtVoxel, MarbleVoxel
+
+
+def make_map(width=24, height=24):
+    return VoxelMap(np.zeros((height, width), dtype=np.uint8), pymunk.Space())
+
+
+def test_fill_rect_across_chunks():
+    terrain = make_map()
+    terrain.fill_rect(4, 6, 20, 10, DirtVoxel)
+    expected = np.zeros((24, 24), dtype=np.uint8)
+    expected[6:10, 4:20] = default_palette().id_of(DirtVoxel)
+    np.testing.assert_array_equal(terrain.state, expected)
+    assert terrain[4, 6] == expected[6, 4]
+
+
+def test_paste_mask_keeps_unmasked_cells():
+    terrain = make_map()
+    terrain.fill_rect(0, 0, 24, 24, MarbleVoxel)
+    mask = np.zeros((4, 4), dtype=bool)
+    mask[1:3, 1:3] = True
+    terrain.paste(6, 6, DirtVoxel, mask=mask)
+
+    palette = default_palette()
+    block = terrain.state[6:10, 6:10]
+    np.testing.assert_array_equal(block == palette.id_of(DirtVoxel), mask)
+    np.testing.assert_array_equal(block[~mask], palette.id_of(MarbleVoxel))
+
+
+def test_paste_array_with_mask():
+    terrain = make_map()
+    values = np.arange(1, 10, dtype=np.uint8).reshape(3, 3) % len(default_palette())
+    mask = np.eye(3, dtype=bool)
+    terrain.paste(7, 7, values, mask=mask)
+    block = terrain.state[7:10, 7:10]
+    np.testing.assert_array_equal(block, np.where(mask, values, EMPTY))
+
+
+def test_fill_circle_marks_grids_for_rebuild():
+    terrain = make_map()
+    for grid in terrain.grids_in_rect(0, 0, 23, 23):
+        grid.update_sprite_cache()
+    terrain.fill_circle(8, 8, 2, DirtVoxel)
+    assert terrain.get_grid_at(8, 8).needs_rebuild
+    assert not terrain.get_grid_at(20, 20).needs_rebuild
+
+
+def test_paste_single_material_needs_mask():
+    terrain = make_map()
+    with pytest.raises(ValueError):
+        terrain.paste(4, 4, DirtVoxel)
+    assert not terrain.state.any()
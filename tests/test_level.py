@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from voxels.level import open_level, read_header, save_level
+from voxels.palette import Palette, default_palette
+from voxels.voxel import DirtVoxel
+
+
+def test_round_trip(tmp_path):
+    filename = str(tmp_path / "level.vxl")
+    state = np.random.RandomState(0).randint(0, len(default_palette()), size=(20, 30)).astype(np.uint8)
+    save_level(filename, state)
+
+    header = read_header(filename)
+    assert (header.width, header.height) == (30, 20)
+    assert header.offset % 64 == 0
+    np.testing.assert_array_equal(open_level(filename), state)
+
+
+def test_copy_on_write_leaves_file_untouched(tmp_path):
+    filename = str(tmp_path / "level.vxl")
+    save_level(filename, np.zeros((4, 4), dtype=np.uint8))
+    level = open_level(filename)
+    level[1, 1] = 1
+    del level
+    assert not open_level(filename).any()
+
+    level = open_level(filename, mode="r+")
+    level[1, 1] = 1
+    level.flush()
+    del level
+    assert open_level(filename)[1, 1] == 1
+
+
+def test_rejects_other_palette(tmp_path):
+    filename = str(tmp_path / "level.vxl")
+    save_level(filename, np.zeros((4, 4), dtype=np.uint8))
+    with pytest.raises(ValueError):
+        open_level(filename, palette=Palette([DirtVoxel]))
+
+
+def test_rejects_other_files(tmp_path):
+    filename = tmp_path / "level.vxl"
+    filename.write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError):
+        read_header(str(filename))
@@ -0,0 +1,76 @@
+import numpy as np
+import pymunk
+
+from voxels.map import VoxelMap
+from voxels.voxel import VOXEL_SIZE, DirtVoxel
+
+
+def terrain(**kwargs):
+    state = np.zeros((32, 32), dtype=np.uint8)
+    state[:4] = 1
+    return VoxelMap(state, pymunk.Space(), **kwargs)
+
+
+def test_solid_everywhere_without_physics_lod():
+    terrain_map = terrain(collision_radius=None)
+    assert len(terrain_map._grids) == terrain_map.columns * terrain_map.rows
+    # the ground under every column of chunks has collision before anything is drawn
+    bodies = {shape.body for shape in terrain_map.space.shapes}
+    assert len(bodies) == terrain_map.columns
+    # but no drawn geometry has been queued for chunks nobody has looked at
+    assert not len(terrain_map.scheduler)
+    terrain_map.close()
+
+
+def test_lazy_by_default():
+    terrain_map = terrain()
+    assert terrain_map.physics_lod
+    assert not terrain_map._grids
+    assert not terrain_map.space.shapes
+    terrain_map.close()
+
+
+def test_collision_built_when_a_body_approaches():
+    terrain_map = terrain()
+    body = pymunk.Body(mass=1, moment=1)
+    body.position = 20 * VOXEL_SIZE, 6 * VOXEL_SIZE
+    terrain_map.update_collision([body])
+    # without waiting for the queued rebuilds
+    grid = terrain_map.get_grid_at(20, 0)
+    assert grid._shapes and grid._body.space is terrain_map.space
+    assert terrain_map.get_grid_at(4, 0) not in terrain_map.collision_grids()
+    terrain_map.close()
+
+
+def test_grids_in_rect_outside_the_map():
+    terrain_map = terrain()
+    assert list(terrain_map.grids_in_rect(-40, -40, -20, -20)) == []
+    assert list(terrain_map.grids_in_rect(40, 40, 60, 60)) == []
+    assert len(list(terrain_map.grids_in_rect(-40, -40, 3, 3))) == 1
+    terrain_map.close()
+
+
+def test_edit_updates_collision_off_screen():
+    terrain_map = terrain(collision_radius=None)
+    terrain_map.fill_rect(8, 4, 16, 12, DirtVoxel)
+    terrain_map.scheduler.flush()
+    grid = terrain_map.get_grid_at(8, 8)
+    assert grid._shapes
+    terrain_map.close()
+
+
+def test_empty_chunks_stay_unallocated():
+    terrain_map = terrain()
+    grids = list(terrain_map.grids_in_rect(0, 0, 31, 31))
+    sky = terrain_map.get_grid_at(16, 24)
+    # the row just above the ground still sees it in its halo
+    assert terrain_map.get_grid_at(16, 8)._body is None
+    assert terrain_map.get_grid_at(16, 0)._body is not None
+    assert sky._body is None and sky.empty
+    assert len(terrain_map.scheduler) == terrain_map.columns
+
+    terrain_map.fill_rect(16, 24, 18, 26, DirtVoxel)
+    terrain_map.scheduler.flush()
+    assert sky._body is not None and not sky.empty
+    assert all(grid.revision for grid in grids if grid._body is not None)
+    terrain_map.close()
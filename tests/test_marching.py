@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from voxels.marching import march, march_uniform
+from voxels.palette import EMPTY, default_palette
+
+
+def uniform_chunk(rng, material, size=8):
+    padded = np.full((size + 1, size + 1), material, dtype=np.uint8)
+    # the halo is all the uniform path ever looks at, so vary it anywhere from untouched to random
+    halo = rng.randint(0, len(default_palette()), size=2 * size + 1).astype(np.uint8)
+    keep = rng.uniform(size=halo.shape) < rng.uniform()
+    halo[keep] = material
+    padded[-1, :] = halo[:size + 1]
+    padded[:-1, -1] = halo[size + 1:]
+    return padded
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_march_uniform_matches_march(seed):
+    rng = np.random.RandomState(seed)
+    palette = default_palette()
+    material = int(rng.randint(0, len(palette)))
+    padded = uniform_chunk(rng, material)
+
+    expected = march(padded, palette)
+    shape_values, materials, weights = march_uniform(padded, material, palette)
+    assert materials == expected[1]
+    np.testing.assert_array_equal(shape_values, expected[0])
+    np.testing.assert_array_equal(weights, expected[2])
+
+
+def test_march_uniform_empty_chunk_and_halo():
+    padded = np.zeros((9, 9), dtype=np.uint8)
+    shape_values, materials, weights = march_uniform(padded, EMPTY)
+    assert materials == []
+    assert not shape_values.any()
+    assert weights.shape == (0, 8, 8)
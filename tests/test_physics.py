@@ -0,0 +1,75 @@
+import numpy as np
+import pymunk
+
+from voxels.map import VoxelMap
+from voxels.voxel import VOXEL_SIZE
+
+
+def terrain():
+    state = np.zeros((16, 64), dtype=np.uint8)
+    state[:4] = 1
+    return VoxelMap(state, pymunk.Space(), collision_radius=4, collision_margin=4)
+
+
+def body_at(x, y, body_type=pymunk.Body.DYNAMIC):
+    body = pymunk.Body(mass=1, moment=1, body_type=body_type)
+    body.position = x * VOXEL_SIZE, y * VOXEL_SIZE
+    return body
+
+
+def has_collision(terrain_map, grid):
+    return grid.collision_active and bool(grid._shapes) and set(grid._shapes) <= set(terrain_map.space.shapes)
+
+
+def test_collision_follows_bodies_with_a_margin():
+    terrain_map = terrain()
+    # the chunk covering cells 24 to 31
+    grid = terrain_map.get_grid_at(24, 0)
+    body = body_at(18.5, 4)
+    terrain_map.update_collision([body])
+    assert not has_collision(terrain_map, grid)
+
+    # within collision_radius cells of it
+    body.position = 20.5 * VOXEL_SIZE, 4 * VOXEL_SIZE
+    terrain_map.update_collision([body])
+    assert has_collision(terrain_map, grid)
+    assert grid in terrain_map.collision_grids()
+
+    # back out past the radius, but not the margin beyond it
+    body.position = 16.5 * VOXEL_SIZE, 4 * VOXEL_SIZE
+    terrain_map.update_collision([body])
+    assert has_collision(terrain_map, grid)
+
+    # past radius + margin
+    body.position = 15.5 * VOXEL_SIZE, 4 * VOXEL_SIZE
+    terrain_map.update_collision([body])
+    assert not grid.collision_active
+    assert not set(grid._shapes) & set(terrain_map.space.shapes)
+    assert grid not in terrain_map.collision_grids()
+
+    # and back on, with the shapes it already had
+    body.position = 21.5 * VOXEL_SIZE, 4 * VOXEL_SIZE
+    terrain_map.update_collision([body])
+    assert has_collision(terrain_map, grid)
+    terrain_map.close()
+
+
+def test_only_dynamic_bodies_count():
+    terrain_map = terrain()
+    terrain_map.update_collision([body_at(28, 4, pymunk.Body.STATIC), body_at(28, 4, pymunk.Body.KINEMATIC)])
+    assert not terrain_map.collision_grids()
+    assert not terrain_map.space.shapes
+    terrain_map.close()
+
+
+def test_lookahead_along_velocity():
+    terrain_map = terrain()
+    grid = terrain_map.get_grid_at(40, 0)
+    body = body_at(28.5, 4)
+    terrain_map.update_collision([body])
+    assert not has_collision(terrain_map, grid)
+    # a quarter of a second at this speed covers the eight cells to the chunk
+    body.velocity = 32 * VOXEL_SIZE, 0
+    terrain_map.update_collision([body])
+    assert has_collision(terrain_map, grid)
+    terrain_map.close()
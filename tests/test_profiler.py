@@ -0,0 +1,61 @@
+import pytest
+
+from bubblestash import profiler as profiler_module
+from bubblestash.profiler import FrameProfiler
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(profiler_module.time, "perf_counter", clock)
+    return clock
+
+
+def test_nested_phases_are_exclusive(clock):
+    profiler = FrameProfiler(enabled=True)
+    with profiler.phase("outer"):
+        clock.sleep(2)
+        with profiler.phase("inner"):
+            clock.sleep(5)
+        clock.sleep(2)
+    profiler.end_frame()
+
+    assert profiler.last("outer") == 4
+    assert profiler.last("inner") == 5
+
+
+def test_repeated_phases_add_up(clock):
+    profiler = FrameProfiler(enabled=True)
+    for _ in range(3):
+        with profiler.phase("step"):
+            clock.sleep(1)
+        clock.sleep(1)
+    profiler.add("count", 2)
+    profiler.watch("watched", lambda: 7)
+    profiler.end_frame()
+
+    assert profiler.last("step") == 3
+    assert profiler.last("count") == 2
+    assert profiler.last("watched") == 7
+    assert profiler.counters == {"count", "watched"}
+
+
+def test_disabled_profiler_records_nothing():
+    profiler = FrameProfiler()
+    with profiler.phase("step"):
+        pass
+    profiler.end_frame()
+    assert profiler.frames == 0
+    assert profiler.stats() == {}
@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+
+from voxels.palette import Palette, default_palette
+from voxels.region import RegionFile, RegionStorage, migrate
+from voxels.store import PNGStorage
+from voxels.voxel import DirtVoxel
+
+
+def random_state(seed, width=8, height=8):
+    rng = np.random.RandomState(seed)
+    return rng.randint(0, len(default_palette()), size=(height, width)).astype(np.uint8)
+
+
+def test_random_access_round_trip(tmp_path):
+    filename = str(tmp_path / "test.region")
+    region = RegionFile(filename, size=4)
+    states = {(column, row): random_state(column * 4 + row) for column in range(4) for row in range(0, 4, 2)}
+    for (column, row), state in states.items():
+        region.write(column, row, state)
+    assert (1, 1) not in region and region.read(1, 1) is None
+    region.close()
+
+    region = RegionFile(filename, size=4)
+    assert sorted(region.chunks()) == sorted(states)
+    for key in [(3, 2), (0, 0), (2, 2)]:
+        np.testing.assert_array_equal(region.read(*key), states[key])
+    region.close()
+
+
+def test_rewrites_never_overwrite_the_current_slot(tmp_path):
+    filename = str(tmp_path / "test.region")
+    region = RegionFile(filename, size=2, width=16, height=16)
+    region.write(0, 0, np.zeros((16, 16), dtype=np.uint8))
+    region.write(1, 0, np.zeros((16, 16), dtype=np.uint8))
+    first = region._index[0][0]
+    end = region._end
+
+    # the new data goes somewhere else even though it would fit, and the old slot is freed after
+    region.write(0, 0, np.ones((16, 16), dtype=np.uint8))
+    assert region._index[0][0] == end
+    assert region._free == [[first, 64]]
+    # which the next rewrite reuses
+    region.write(0, 0, np.zeros((16, 16), dtype=np.uint8))
+    assert region._index[0][0] == first
+    second = end
+    # noise doesn't fit any free slot, so it goes to the end of the file
+    noisy = random_state(1, 16, 16)
+    end = region._end
+    region.write(0, 0, noisy)
+    assert region._index[0][0] == end
+    assert region._free == [[first, 64], [second, 64]]
+    # freeing the slot between them merges all three
+    region.write(1, 0, noisy)
+    assert region._free == [[first, 192]]
+    region.close()
+
+    region = RegionFile(filename, size=2, width=16, height=16)
+    np.testing.assert_array_equal(region.read(0, 0), noisy)
+    np.testing.assert_array_equal(region.read(1, 0), noisy)
+    # the free slots are found again from the gaps in the index
+    assert region._free == [[first, 192]]
+    region.close()
+
+
+def test_rejects_mismatched_files(tmp_path):
+    filename = str(tmp_path / "test.region")
+    RegionFile(filename, size=4).close()
+    with pytest.raises(ValueError):
+        RegionFile(filename, size=8)
+    with pytest.raises(ValueError):
+        RegionFile(filename, size=4, palette=Palette([DirtVoxel]))
+
+    other = tmp_path / "other.region"
+    other.write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError):
+        RegionFile(str(other))
+
+
+def test_storage_spans_regions(tmp_path):
+    storage = RegionStorage(str(tmp_path), size=2, max_open=1)
+    origins = [(-8, -8), (0, 0), (8, 8), (16, 0), (-24, 40)]
+    for i, (x, y) in enumerate(origins):
+        storage.write(x, y, random_state(i))
+    assert not storage.has(24, 24)
+    assert storage.read(24, 24) is None
+    for i, (x, y) in enumerate(origins):
+        assert storage.has(x, y)
+        np.testing.assert_array_equal(storage.read(x, y), random_state(i))
+    storage.close()
+    assert len(list(tmp_path.iterdir())) == 4
+
+
+def test_migrate_png_chunks(tmp_path):
+    png = PNGStorage(str(tmp_path))
+    origins = [(0, 0), (8, 0), (-8, 16)]
+    for i, (x, y) in enumerate(origins):
+        png.write(x, y, random_state(i))
+    PNGStorage(str(tmp_path), 4, 4).write(0, 0, random_state(9, 4, 4))
+
+    assert migrate(str(tmp_path)) == (4, 0)
+    assert migrate(str(tmp_path), delete=True) == (0, 4)
+    assert not [path for path in tmp_path.iterdir() if path.suffix == ".png"]
+
+    storage = RegionStorage(str(tmp_path))
+    for i, (x, y) in enumerate(origins):
+        np.testing.assert_array_equal(storage.read(x, y), random_state(i))
+    np.testing.assert_array_equal(RegionStorage(str(tmp_path), 4, 4).read(0, 0), random_state(9, 4, 4))
@@ -0,0 +1,129 @@
+import numpy as np
+import pyglet
+import pymunk
+import pytest
+
+from bubblestash.actor import Actor
+from bubblestash.stage import Stage
+
+
+@pytest.fixture(scope="module")
+def image():
+    image = pyglet.image.SolidColorImagePattern((255, 255, 255, 255)).create_image(8, 4)
+    image.anchor_x, image.anchor_y = 4, 2
+    return image
+
+
+def make_actor(image, x, y, cls=Actor):
+    body = pymunk.Body(mass=1, moment=10)
+    return cls(body, pymunk.Circle(body, 2), x=x, y=y, img=image, subpixel=True)
+
+
+def quad(actor):
+    return np.array(actor._vertex_list.vertices[:]).reshape(4, 2)
+
+
+def test_bulk_synced_sprite_reports_its_pose(image):
+    stage = Stage()
+    actors = [make_actor(image, 10 * i, 100) for i in range(3)]
+    for actor in actors:
+        stage.add_actor(actor)
+    for actor in actors:
+        actor.body.velocity = 30, -20
+    actors[1].body.angle = np.pi / 2
+    stage.act(0.1)
+
+    for actor in actors:
+        assert actor.x == pytest.approx(actor.body.position.x)
+        assert actor.y == pytest.approx(actor.body.position.y)
+        assert actor.position == pytest.approx(tuple(actor.body.position))
+    assert actors[1].rotation == pytest.approx(-90)
+    np.testing.assert_allclose(quad(actors[0]).mean(axis=0), tuple(actors[0].body.position))
+
+
+def test_changing_a_sprite_relays_out_its_quad(image):
+    stage = Stage()
+    actors = [make_actor(image, 10 * i, 100) for i in range(3)]
+    for actor in actors:
+        stage.add_actor(actor)
+        actor.body.velocity = 30, -20
+    stage.act(0.1)
+
+    actors[2].scale = 2
+    actors[0].visible = False
+    stage.draw()
+    x, y = actors[2].body.position
+    np.testing.assert_allclose(quad(actors[2]), [(x - 8, y - 4), (x + 8, y - 4), (x + 8, y + 4), (x - 8, y + 4)])
+    assert not quad(actors[0]).any()
+    stage.act(0.1)
+    x, y = actors[2].body.position
+    np.testing.assert_allclose(quad(actors[2]), [(x - 8, y - 4), (x + 8, y - 4), (x + 8, y + 4), (x - 8, y + 4)])
+
+    actors[1].group = pyglet.graphics.OrderedGroup(1)
+    stage.act(0.1)
+    np.testing.assert_allclose(quad(actors[1]).mean(axis=0), tuple(actors[1].body.position))
+
+
+def test_removed_actor_syncs_itself(image):
+    stage = Stage()
+    actor = make_actor(image, 0, 0)
+    stage.add_actor(actor)
+    stage.act(0.1)
+    stage.remove_actor(actor)
+    actor.body.position = 50, 60
+    actor.act(0)
+    assert actor.position == (50, 60)
+
+
+class CustomActor(Actor):
+    """Has its own act, so it interpolates itself rather than being synced in bulk"""
+
+    def act(self, dt):
+        super().act(dt)
+
+
+def test_accumulator_carries_time_between_frames(image):
+    stage = Stage(tick_rate=50)
+    stage.add_actor(make_actor(image, 0, 0))
+    stage.act(0.015)
+    assert stage.ticks == 0 and stage.tick_count == 0
+    assert stage.alpha == pytest.approx(0.75)
+    stage.act(0.015)
+    assert stage.ticks == 1 and stage.tick_count == 1
+    assert stage.alpha == pytest.approx(0.5)
+    stage.act(0.035)
+    assert stage.ticks == 2 and stage.tick_count == 3
+    assert stage.alpha == pytest.approx(0.25)
+
+
+def test_long_frame_runs_at_most_max_substeps(image):
+    stage = Stage(tick_rate=50, max_substeps=3)
+    actor = make_actor(image, 0, 0)
+    stage.add_actor(actor)
+    actor.body.velocity = 100, 0
+    stage.act(1.)
+    # the rest of the frame is dropped rather than carried into later frames
+    assert stage.ticks == 3 and stage.tick_count == 3
+    assert stage.alpha == pytest.approx(0)
+    assert actor.body.position.x == pytest.approx(6)
+    stage.act(0.01)
+    assert stage.ticks == 0
+    assert stage.alpha == pytest.approx(0.5)
+
+
+def test_drawn_poses_interpolate_between_ticks(image):
+    stage = Stage(tick_rate=50)
+    plain, custom = make_actor(image, 0, 0), make_actor(image, 0, 100, cls=CustomActor)
+    for actor in (plain, custom):
+        stage.add_actor(actor)
+        actor.body.velocity = 100, 0
+        actor.body.angular_velocity = 10
+    stage.act(0.02)
+    stage.act(0.03)
+    # two ticks in: the previous pose is at x=2, the current one at x=4, and half a tick has passed since
+    assert stage.alpha == pytest.approx(0.5)
+    for actor in (plain, custom):
+        assert actor.body.position.x == pytest.approx(4)
+        assert actor.x == pytest.approx(3)
+        assert actor.rotation == pytest.approx(-np.degrees(0.3))
+    np.testing.assert_allclose(quad(plain).mean(axis=0), (3, 0), atol=1e-4)
@@ -0,0 +1,68 @@
+import numpy as np
+import pymunk
+import pytest
+
+from voxels.palette import EMPTY, default_palette
+from voxels.store import VoxelGridStore
+from voxels.voxel import DirtVoxel, IronVoxel, MarbleVoxel
+
+VOXELS = {DirtVoxel: 0.5, MarbleVoxel: 0.3, IronVoxel: 0.2}
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = VoxelGridStore(pymunk.Space(), state_dir=str(tmp_path), grid_width=8, grid_height=8,
+                           known_voxels=VOXELS, seed=3, capacity=64)
+    yield store
+    store.close()
+
+
+@pytest.mark.parametrize("storage", ["png", "region"])
+def test_storage_round_trip(tmp_path, storage):
+    store = VoxelGridStore(pymunk.Space(), state_dir=str(tmp_path), grid_width=8, grid_height=8,
+                           known_voxels=VOXELS, seed=3, storage=storage)
+    state = np.random.RandomState(0).randint(0, len(default_palette()), size=(8, 8)).astype(np.uint8)
+    assert not store.has_state(16, 24)
+    store[16, 24] = state
+    assert store.has_state(16, 24)
+    np.testing.assert_array_equal(store._read_state(16, 24), state)
+    store.close()
+
+
+def neighbour_halo(store, x, y):
+    """The halo as the old neighbour lookups built it, from fully loaded neighbours"""
+    halo = np.zeros((9, 9), dtype=np.uint8)
+    halo[:8, :8] = store[x, y].state
+    halo[:8, 8] = store[x + 8, y].state[:, 0]
+    halo[8, :8] = store[x, y + 8].state[0, :]
+    halo[8, 8] = store[x + 8, y + 8].state[0, 0]
+    return halo
+
+
+def test_halo_from_generated_edges(store):
+    halo = store[0, 0].get_halo_state()
+    # only the chunk itself was loaded to build it
+    assert store.stats()["chunks"] == 1
+    np.testing.assert_array_equal(halo, neighbour_halo(store, 0, 0))
+
+
+def test_halo_from_saved_and_evicted_edges(tmp_path):
+    store = VoxelGridStore(pymunk.Space(), state_dir=str(tmp_path), grid_width=8, grid_height=8,
+                           known_voxels=VOXELS, seed=3, capacity=2)
+    store.fill_rect(8, 0, 10, 8, EMPTY)
+    store.fill_rect(0, 8, 8, 10, MarbleVoxel)
+    # push the edited neighbours out, so their edges come from the strip cache
+    for i in range(4):
+        store[800 + i * 8, 800]
+    halo = store[0, 0].get_halo_state()
+    np.testing.assert_array_equal(halo, neighbour_halo(store, 0, 0))
+    store.close()
+
+    # a fresh store only has the files to go on
+    store = VoxelGridStore(pymunk.Space(), state_dir=str(tmp_path), grid_width=8, grid_height=8,
+                           known_voxels=VOXELS, seed=3)
+    halo = store[0, 0].get_halo_state()
+    assert store.stats()["chunks"] == 1
+    np.testing.assert_array_equal(halo, neighbour_halo(store, 0, 0))
+    assert not halo[:8, 8].any()
+    store.close()
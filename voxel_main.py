@@ -1,17 +1,36 @@
+import argparse
+import json
+import random
+import sys
+import time
+
 import numpy as np
 
 import pyglet
-import pymunk
-from pyglet.window import key, mouse
 
-from bubblestash import controls, actor
-from bubblestash.camera import Camera
-from bubblestash.stage import Stage
-from bubblestash.window import GameWindow
-from voxels.map import VoxelMap
-from voxels.perlin import generate_random_map
-from voxels.store import VoxelGridStore
-from voxels.voxel import EMPTY_VOXEL, DiamondVoxel, DirtVoxel, MarbleVoxel, IronVoxel
+if "--headless" in sys.argv:
+    pyglet.options['headless'] = True
+
+import pymunk  # noqa: E402
+from pyglet.window import key, mouse  # noqa: E402
+
+from bubblestash import controls, actor  # noqa: E402
+from bubblestash.camera import Camera  # noqa: E402
+from bubblestash.profiler import ProfilerOverlay, profiler  # noqa: E402
+from bubblestash.replay import CUSTOM, KEY_PRESS, KEY_RELEASE, InputRecorder, InputReplay  # noqa: E402
+from bubblestash.stage import Stage  # noqa: E402
+from bubblestash.window import GameWindow  # noqa: E402
+from voxels.level import open_level  # noqa: E402
+from voxels.map import VoxelMap  # noqa: E402
+from voxels.palette import EMPTY  # noqa: E402
+from voxels.perlin import NoiseGenerator, generate_random_map  # noqa: E402
+from voxels.store import VoxelGridStore  # noqa: E402
+from voxels.voxel import VOXEL_SIZE, DiamondVoxel, DirtVoxel, MarbleVoxel, IronVoxel  # noqa: E402
+
+# replayable game events, beyond the key presses and releases
+EDIT = CUSTOM
+SPAWN = CUSTOM + 1
+ZOOM = CUSTOM + 2
 
 
 class CollisionTypes(object):
@@ -107,14 +126,30 @@ class Player(actor.Actor):
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Voxel terrain demo")
+    parser.add_argument("--seed", type=int, help="world seed, random by default")
+    parser.add_argument("--level", help="play a level file (see voxels.level) instead of a generated map")
+    parser.add_argument("--record", metavar="FILE", help="record input to FILE on exit")
+    parser.add_argument("--replay", metavar="FILE", help="play back input recorded with --record")
+    parser.add_argument("--headless", action="store_true", help="replay without a visible window")
+    parser.add_argument("--trace", metavar="FILE", help="write the replay's frame times to FILE as JSON")
+    args = parser.parse_args()
+
+    replay = InputReplay(args.replay) if args.replay else None
+    if replay is not None:
+        seed = replay.meta["seed"]
+        # recordings from before --level existed were always of a generated map
+        args.level = replay.meta.get("level") or None
+    else:
+        seed = args.seed if args.seed is not None else random.randint(0, 2 ** 31 - 1)
 
     CAMERA_MOVE_SPEED = 300
 
     camera = Camera(0, 0, 1920, 1080, zoom=0.3)
     camera.init_gl()
-    window = GameWindow(width=1920, height=1080, camera=camera)
+    window = GameWindow(width=1920, height=1080, camera=camera, vsync=replay is None, visible=not args.headless)
 
-    stage = Stage()
+    stage = Stage(tick_rate=60)
     space = stage.space
     stage.space.gravity = 0, -900
     input_handler = controls.KeyboardInputHandler({
@@ -130,37 +165,73 @@ if __name__ == "__main__":
         key.LSHIFT: "CAMERA_ZOOM_MOD",
         key.ESCAPE: "EXIT_GAME"
     })
+    overlay = ProfilerOverlay(window)
+    recorder = InputRecorder(stage, seed=seed, level=args.level or "") if args.record else None
+
+
+    def apply_event(kind, a=0, b=0, c=0):
+        if kind == KEY_PRESS:
+            input_handler.on_key_press(a, b)
+        elif kind == KEY_RELEASE:
+            input_handler.on_key_release(a, b)
+        elif kind == EDIT:
+            map[a, b] = c
+        elif kind == SPAWN:
+            stage.add_actor(Boulder(x=a, y=b))
+        elif kind == ZOOM:
+            camera.update(zoom=a / 1000)
+
+
+    def send(kind, *event_args):
+        """Apply a live input event, recording it first when recording; live input is ignored in replays"""
+        if replay is not None:
+            return
+        if recorder is not None:
+            recorder.record(kind, *event_args)
+        apply_event(kind, *event_args)
 
 
     @window.event
     def on_key_press(symbol, modifiers):
-        return input_handler.on_key_press(symbol, modifiers)
+        if symbol == key.F3:
+            profiler.enabled = not profiler.enabled
+            profiler.reset()
+        send(KEY_PRESS, symbol, modifiers)
 
 
     @window.event
     def on_key_release(symbol, modifiers):
-        return input_handler.on_key_release(symbol, modifiers)
+        send(KEY_RELEASE, symbol, modifiers)
 
 
+    noise = NoiseGenerator(seed=seed)
     maps = [generate_random_map(64, 64, {
         DirtVoxel: 0.2,
         IronVoxel: 0.2,
         DiamondVoxel: 0.2,
-    }) for _ in range(2)]
+    }, origin=(i * 64, 0), noise=noise) for i in range(2)]
 
-    map_state = np.hstack(maps)
+    # a level file is mapped rather than read, so its chunks are paged in as they are touched
+    map_state = open_level(args.level) if args.level else np.hstack(maps)
     # cv2.imwrite("./data/new_level.png", map_state)
     # map_state = cv2.imread("./data/new_level.png")
-    map = VoxelMap(state=map_state, space=space)
+    map = VoxelMap(state=map_state, space=space, collision_radius=4)
+    # recordings and their replays step the terrain under the same rules, whatever the frame rate
+    map.follow(stage, flush=recorder is not None or replay is not None)
 
     player = Player(input_handler, x=1024, y=2060)
     camera.look_at(player, animate=False)
     stage.add_actor(player)
+    # chunks are built as they are first approached; build the ones around the spawn before the first frame
+    map.warm_up(int(player.x) // VOXEL_SIZE, int(player.y) // VOXEL_SIZE, radius=16)
+
+    profiler.watch("actors", lambda: len(stage.actors))
+    profiler.watch("shapes", lambda: len(space.shapes))
+    profiler.watch("chunks", lambda: map.stats()["chunks"])
 
 
-    # image based loading
-    # map_state = cv2.imread("./data/images/example_level.png")
-    # map = VoxelMap(state=map_state, space=space)
+    # image based loading: convert the image once, then run with --level data/levels/example_level.vxl
+    #   python -m voxels.level import data/images/example_level.png data/levels/example_level.vxl
 
     # Infinite random map
     # map = VoxelGridStore(space=space, known_voxels={
@@ -177,12 +248,11 @@ if __name__ == "__main__":
         y = _y // 32 + 1
         if button == mouse.LEFT:
             if modifiers == 17:
-                rock = Boulder(x=_x, y=_y)
-                stage.add_actor(rock)
+                send(SPAWN, _x, _y)
             else:
-                map[x, y] = (0, 0, 0)
+                send(EDIT, x, y, map.palette.id_of(DirtVoxel))
         if button == mouse.RIGHT:
-            map[x, y] = EMPTY_VOXEL
+            send(EDIT, x, y, EMPTY)
 
 
     @window.event
@@ -191,18 +261,19 @@ if __name__ == "__main__":
         x = _x // 32
         y = _y // 32 + 1
         if buttons == mouse.LEFT:
-            map[x, y] = (0, 0, 0)
+            send(EDIT, x, y, map.palette.id_of(DirtVoxel))
         if buttons == mouse.RIGHT:
-            map[x, y] = EMPTY_VOXEL
+            send(EDIT, x, y, EMPTY)
 
 
     @window.event
     def on_mouse_scroll(x, y, scroll_x, scroll_y):
         if input_handler.key_down("CAMERA_ZOOM_MOD"):
             min_zoom = 0.1
-            max_zoom = 5.0
-            zoom = max(min(camera.zoom + (scroll_y / 10), max_zoom), min_zoom)
-            camera.update(zoom=zoom)
+            # far enough out for the terrain's region tier; steps are relative so both ends stay usable
+            max_zoom = 16.0
+            zoom = max(min(camera.zoom * 1.1 ** scroll_y, max_zoom), min_zoom)
+            send(ZOOM, round(zoom * 1000))
 
 
     def pre_solve_platform(arbiter, space, data):
@@ -247,15 +318,54 @@ if __name__ == "__main__":
         #     )
 
         if input_handler.key_down("EXIT_GAME"):
-            exit(0)
+            pyglet.app.exit()
         stage.act(dt)
-        camera.act(dt)
-        camera.look_at(player)
+        with profiler.phase("camera"):
+            camera.act(dt)
+            camera.look_at(player)
+
+
+    @window.event
+    def on_draw():
         window.clear()
-        map.draw(camera)
+        map.draw(camera, focus=(player.x, player.y))
         stage.draw()
         # label.draw()
-
-
-    pyglet.clock.schedule_interval(update, 1 / 60.0)
-    pyglet.app.run()
+        overlay.draw()
+        profiler.end_frame()
+
+
+    def run_replay():
+        """Step the recorded session one tick per frame as fast as possible, timing every frame"""
+        profiler.enabled = True
+        step = 1. / stage.tick_rate
+        frame_ms = []
+        for tick in range(replay.ticks):
+            start = time.perf_counter()
+            for kind, event_args in replay.events_at(tick):
+                apply_event(kind, *event_args)
+            update(step)
+            window.switch_to()
+            window.dispatch_events()
+            on_draw()
+            window.flip()
+            frame_ms.append((time.perf_counter() - start) * 1000)
+
+        p50, p95, p99 = np.percentile(frame_ms, [50, 95, 99])
+        print("replayed {} ticks: frame p50 {:.2f} ms, p95 {:.2f} ms, p99 {:.2f} ms".format(
+            replay.ticks, p50, p95, p99))
+        if args.trace:
+            with open(args.trace, "w") as f:
+                json.dump({"seed": seed, "ticks": replay.ticks, "frame_ms": frame_ms,
+                           "p50": p50, "p95": p95, "p99": p99, "phases": profiler.stats()}, f)
+
+
+    if replay is not None:
+        run_replay()
+    else:
+        # physics ticks at a fixed rate inside stage.act; drawing follows the display's refresh rate
+        pyglet.clock.schedule(update)
+        pyglet.app.run()
+        if recorder is not None:
+            recorder.save(args.record)
+    map.close()
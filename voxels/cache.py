@@ -0,0 +1,102 @@
+from collections import OrderedDict
+
+
+class ChunkCache(object):
+    """Least-recently-used chunk cache bounded by count and/or bytes; keys in `pinned` are never evicted"""
+
+    def __init__(self, capacity=None, max_bytes=None, sizeof=None, on_evict=None):
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda value: 0)
+        self.on_evict = on_evict
+        self.pinned = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._sizes = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __iter__(self):
+        return iter(list(self._entries))
+
+    def get(self, key, default=None):
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return value
+
+    def peek(self, key, default=None):
+        """Look up `key` without counting it or refreshing its position"""
+        return self._entries.get(key, default)
+
+    def values(self):
+        return list(self._entries.values())
+
+    def __setitem__(self, key, value):
+        if key in self._entries:
+            self.bytes -= self._sizes.pop(key)
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        self._sizes[key] = self.sizeof(value)
+        self.bytes += self._sizes[key]
+        self.trim()
+
+    def resize(self, key):
+        """Re-measure `key`'s value after it grew or shrank in place, evicting other entries if it went over budget"""
+        if key not in self._entries:
+            return
+        self.bytes -= self._sizes[key]
+        self._sizes[key] = self.sizeof(self._entries[key])
+        self.bytes += self._sizes[key]
+        self.trim(keep=key)
+
+    def pop(self, key, default=None):
+        value = self._entries.pop(key, None)
+        if value is None:
+            return default
+        self.bytes -= self._sizes.pop(key)
+        return value
+
+    def _over_budget(self):
+        if self.capacity is not None and len(self._entries) > self.capacity:
+            return True
+        return self.max_bytes is not None and self.bytes > self.max_bytes
+
+    def trim(self, keep=None):
+        """Evict least recently used, unpinned entries other than `keep` until the cache is back within its limits"""
+        if not self._over_budget():
+            return
+        for key in list(self._entries):
+            if not self._over_budget():
+                break
+            if key in self.pinned or key == keep:
+                continue
+            value = self.pop(key)
+            self.evictions += 1
+            if self.on_evict is not None:
+                self.on_evict(key, value)
+
+    def clear(self):
+        for key in list(self._entries):
+            value = self.pop(key)
+            if self.on_evict is not None:
+                self.on_evict(key, value)
+
+    def stats(self):
+        return {
+            "chunks": len(self._entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,81 @@
+import numpy as np
+import pymunk
+
+from voxels.voxel import VOXEL_SEGMENTS, VOXEL_SIZE
+
+SEGMENT_RADIUS = 3
+SEGMENT_ELASTICITY = .1
+SEGMENT_FRICTION = 0.7
+SEGMENT_COLLISION_TYPE = 0b00000001
+
+_SEGMENT_TABLE = [np.array(VOXEL_SEGMENTS.get(value, ()), dtype=np.int64).reshape(-1, 4) for value in range(16)]
+
+
+def chunk_segments(shape_values):
+    """Contour segments (N, 4) for a (height, width) array of shape values, in chunk-local pixels"""
+    parts = []
+    for value in np.unique(shape_values):
+        table = _SEGMENT_TABLE[value]
+        if not len(table):
+            continue
+        ys, xs = np.nonzero(shape_values == value)
+        offsets = np.stack([xs, ys, xs, ys], axis=1) * VOXEL_SIZE
+        parts.append((offsets[:, None, :] + table[None, :, :]).reshape(-1, 4))
+    if not parts:
+        return np.zeros((0, 4), dtype=np.int64)
+    return np.concatenate(parts)
+
+
+def merge_segments(segments):
+    """Join collinear segments that touch or overlap into single runs"""
+    if not len(segments):
+        return segments.astype(float)
+
+    a = segments[:, :2]
+    b = segments[:, 2:]
+    d = b - a
+    swap = (d[:, 0] < 0) | ((d[:, 0] == 0) & (d[:, 1] < 0))
+    a, b = np.where(swap[:, None], b, a), np.where(swap[:, None], a, b)
+    d = b - a
+    d //= np.maximum(np.gcd(d[:, 0], d[:, 1]), 1)[:, None]
+
+    # segments on the same infinite line share direction and offset; t orders them along it
+    offset = d[:, 0] * a[:, 1] - d[:, 1] * a[:, 0]
+    t0 = (a * d).sum(axis=1)
+    t1 = (b * d).sum(axis=1)
+    order = np.lexsort((t0, offset, d[:, 1], d[:, 0]))
+    a, d, offset, t0, t1 = a[order], d[order], offset[order], t0[order], t1[order]
+
+    key = np.stack([d[:, 0], d[:, 1], offset], axis=1)
+    new_line = np.r_[True, np.any(key[1:] != key[:-1], axis=1)]
+
+    # shift every line onto its own stretch of t so one running maximum covers all of them
+    shift = (np.cumsum(new_line) - 1) * (t1.max() - t0.min() + 1)
+    reach = np.maximum.accumulate(t1 + shift)
+    starts = new_line | np.r_[True, t0[1:] + shift[1:] > reach[:-1]]
+
+    first = np.flatnonzero(starts)
+    last = np.r_[first[1:], len(starts)] - 1
+    length = (reach[last] - shift[last] - t0[first]) / (d[first] * d[first]).sum(axis=1)
+    start = a[first].astype(float)
+    end = start + d[first] * length[:, None]
+    return np.hstack([start, end])
+
+
+def contour_segments(shape_values):
+    return merge_segments(chunk_segments(shape_values))
+
+
+def create_shapes(body, segments):
+    shapes = []
+    for x0, y0, x1, y1 in segments.tolist():
+        segment = pymunk.Segment(body, (x0, y0), (x1, y1), SEGMENT_RADIUS)
+        segment.elasticity = SEGMENT_ELASTICITY
+        segment.friction = SEGMENT_FRICTION
+        segment.collision_type = SEGMENT_COLLISION_TYPE
+        shapes.append(segment)
+    return shapes
+
+
+def build_shapes(body, shape_values):
+    return create_shapes(body, contour_segments(shape_values))
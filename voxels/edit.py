@@ -0,0 +1,72 @@
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class TerrainEditor(object):
+    """Vectorised edits for anything with `grids_in_rect`, each touched grid rebuilt once per transaction"""
+    _edit_depth = 0
+    _edited_grids = None
+
+    @contextmanager
+    def transaction(self):
+        if not self._edit_depth:
+            self._edited_grids = {}
+        self._edit_depth += 1
+        try:
+            yield self
+        finally:
+            self._edit_depth -= 1
+            if not self._edit_depth:
+                grids, self._edited_grids = self._edited_grids, None
+                self._commit(list(grids.values()))
+
+    def _commit(self, grids):
+        if getattr(self, "scheduler", None) is not None:
+            # the touched grids queued themselves as they went dirty; the scheduler rebuilds each once
+            return
+        for grid in grids:
+            if grid.needs_rebuild:
+                grid.update_sprite_cache()
+
+    def paste(self, x, y, values, mask=None):
+        """Write a (height, width) block of material IDs, or one material under `mask`, from bottom-left cell (x, y)"""
+        if mask is not None:
+            mask = np.asarray(mask, dtype=bool)
+        if np.ndim(values) == 3:
+            values = self.palette.from_colors(values)
+        elif np.ndim(values) < 2:
+            if mask is None:
+                raise ValueError("a single material needs a mask to give the block its shape")
+            values = np.full(mask.shape, self.palette.id_of(values), dtype=np.uint8)
+        height, width = values.shape
+
+        with self.transaction():
+            # the block's corners also shape the row and column of cells just left of and below it
+            for grid in self.grids_in_rect(x - 1, y - 1, x + width - 1, y + height - 1):
+                grid_height, grid_width = grid.state.shape[:2]
+                left, right = max(x, grid.x), min(x + width, grid.x + grid_width)
+                bottom, top = max(y, grid.y), min(y + height, grid.y + grid_height)
+                if left < right and bottom < top:
+                    source = values[bottom - y:top - y, left - x:right - x]
+                    target = grid.own_state()[bottom - grid.y:top - grid.y, left - grid.x:right - grid.x]
+                    if mask is not None:
+                        source = np.where(mask[bottom - y:top - y, left - x:right - x], source, target)
+                    target[...] = source
+                    grid.modified = True
+                grid.mark_dirty_rect(x - 1, y - 1, x + width, y + height)
+                self._edited_grids[id(grid)] = grid
+
+    def fill_rect(self, left, bottom, right, top, value):
+        """Fill cells from (left, bottom) up to but not including (right, top)"""
+        self.paste(left, bottom, value, mask=np.ones((top - bottom, right - left), dtype=bool))
+
+    def stamp(self, x, y, brush, value):
+        """Paint `value` wherever the boolean `brush` is set, centred on cell (x, y)"""
+        brush = np.asarray(brush, dtype=bool)
+        height, width = brush.shape
+        self.paste(x - width // 2, y - height // 2, value, mask=brush)
+
+    def fill_circle(self, x, y, radius, value):
+        span = np.arange(-radius, radius + 1)
+        self.stamp(x, y, span[None, :] ** 2 + span[:, None] ** 2 <= radius ** 2, value)
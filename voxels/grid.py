@@ -1,87 +1,340 @@
-from collections import Counter
-
 import numpy as np
 import pyglet
+import pymunk
 
-from voxels.voxel import EMPTY_VOXEL, Voxel
+from voxels.collision import contour_segments, create_shapes
+from voxels.marching import layer_shapes, march
+from voxels.palette import EMPTY, default_palette
+from voxels.mesh import MAX_LAYERS, build_geometry, march_chunk, tile_layers
+from voxels.render import BakedQuad, TileMesh
+from voxels.uniform import shared_state
+from voxels.voxel import VOXEL_SIZE
 
 
 class VoxelGrid(object):
 
-    def __init__(self, x, y, width, height, space, state=None):
+    def __init__(self, x, y, width, height, space, state=None, tilemap=True, palette=None, scheduler=None,
+                 collision=True):
         self.x = x
         self.y = y
         self.width = width
         self.height = height
         self.space = space
-        self.state = state if state is not None else (np.ones(self.width, self.height, 3) * EMPTY_VOXEL)
+        self.state = state if state is not None else shared_state(EMPTY, (self.height, self.width))
+        self.palette = palette or default_palette()
+        self.tilemap = tilemap
+        self._sprite_cache = {}
+        self._mesh = None
+        self._dirty_cells = set()
+        self.modified = False
+        # bumped every time the drawn geometry changes, so baked copies of it know when they are stale
+        self.revision = 0
+        self._shapes = []
+        # inactive grids keep their shapes out of the space and skip building new ones until reactivated
+        self.collision_active = collision
+        self._collision_stale = False
+        # False until shape values have been marched from the state, by a rebuild or `build_collision`
+        self._marched = False
+        # with a scheduler, rebuilds are queued and the previous geometry keeps drawing until they run
+        self.scheduler = scheduler
+        self._body = None
+        if self.state.any() or self.get_halo_state().any():
+            self._allocate()
+        else:
+            # air with nothing next to it: no batch, body or rebuild until something is written nearby
+            self._dirty = False
+            self.empty = True
+
+    def _allocate(self):
+        """Set up what drawing and collision need and queue the first full rebuild"""
+        if self._body is not None:
+            return
         self._sprite_batch = pyglet.graphics.Batch()
-        self._sprite_cache = []
+        self._tile_material = np.zeros(self.state.shape[:2] + (MAX_LAYERS,), dtype=np.uint8)
+        self._tile_shape = np.zeros(self.state.shape[:2] + (MAX_LAYERS,), dtype=np.uint8)
+        self._shape_values = np.zeros(self.state.shape[:2], dtype=np.uint8)
+        self._body = pymunk.Body(body_type=pymunk.Body.STATIC)
+        self._body.position = self.x * VOXEL_SIZE, self.y * VOXEL_SIZE
         self._dirty = True
+        # nothing to draw and no collision; set once the first build finds the chunk and its halo empty
+        self.empty = False
+        if self.scheduler is not None:
+            self.scheduler.queue(self)
 
     def get_state_at(self, x, y):
         _x = x - self.x
         _y = y - self.y
         if _x < 0 or _y < 0:
-            return EMPTY_VOXEL
+            return EMPTY
         elif _x >= self.width:
             if hasattr(self, 'neighbor_x') and self.neighbor_x is not None:
                 return self.neighbor_x.get_state_at(x, y)
             else:
-                return EMPTY_VOXEL
+                return EMPTY
         elif _y >= self.height:
             if hasattr(self, 'neighbor_y') and self.neighbor_y is not None:
                 return self.neighbor_y.get_state_at(x, y)
             else:
-                return EMPTY_VOXEL
+                return EMPTY
         else:
             s_height, s_width = self.state.shape[:2]
             if s_height > _y and s_width > _x:
-                return tuple(self.state[_y, _x].tolist())
+                return int(self.state[_y, _x])
             else:
-                return EMPTY_VOXEL
+                return EMPTY
+
+    def get_halo_state(self):
+        """This grid's state plus the one-cell halo from `neighbor_x` and `neighbor_y` that marching squares needs"""
+        height, width = self.state.shape[:2]
+        padded = np.zeros((height + 1, width + 1), dtype=np.uint8)
+        padded[:height, :width] = self.state
+
+        neighbor_x = getattr(self, 'neighbor_x', None) if width == self.width else None
+        neighbor_y = getattr(self, 'neighbor_y', None) if height == self.height else None
+        if neighbor_x is not None:
+            column = neighbor_x.state[:height, 0]
+            padded[:len(column), width] = column
+            corner = getattr(neighbor_x, 'neighbor_y', None) if height == self.height else None
+            if corner is not None and corner.state.size:
+                padded[height, width] = corner.state[0, 0]
+        if neighbor_y is not None:
+            row = neighbor_y.state[0, :width]
+            padded[height, :len(row)] = row
+        return padded
+
+    def mark_dirty(self, x, y):
+        """Queue the cell at world position (x, y) for rebuilding, if it belongs to this grid"""
+        _x = x - self.x
+        _y = y - self.y
+        height, width = self.state.shape[:2]
+        if 0 <= _x < width and 0 <= _y < height:
+            self._allocate()
+            self._dirty_cells.add((_x, _y))
+            if self.scheduler is not None:
+                self.scheduler.queue(self)
+
+    def mark_dirty_rect(self, left, bottom, right, top):
+        """Queue every cell of this grid inside the world rectangle [left, right) x [bottom, top)"""
+        height, width = self.state.shape[:2]
+        x0, x1 = max(left - self.x, 0), min(right - self.x, width)
+        y0, y1 = max(bottom - self.y, 0), min(top - self.y, height)
+        if x0 >= x1 or y0 >= y1:
+            return
+        self._allocate()
+        if (x1 - x0) * (y1 - y0) * 2 >= width * height:
+            # most of the chunk is changing, a full rebuild is cheaper than tracking every cell
+            self._dirty = True
+        else:
+            self._dirty_cells.update((_x, _y) for _y in range(y0, y1) for _x in range(x0, x1))
+        if self.scheduler is not None:
+            self.scheduler.queue(self)
+
+    @property
+    def dirty(self):
+        """True when the next rebuild has to be a full one"""
+        return self._dirty
+
+    @property
+    def needs_rebuild(self):
+        return self._dirty or bool(self._dirty_cells)
 
     def update_sprite_cache(self):
+        self._allocate()
+        if self._dirty:
+            self.apply_geometry(self.compute_geometry())
+            return
+
+        xs, ys = zip(*self._dirty_cells)
+        left, bottom, right, top = min(xs), min(ys), max(xs) + 1, max(ys) + 1
+        shape_values, materials, weights = march(self.get_halo_state()[bottom:top + 1, left:right + 1],
+                                                self.palette)
+        layers = layer_shapes(shape_values, weights)
+        collision_changed = not np.array_equal(self._shape_values[bottom:top, left:right], shape_values)
+        self._shape_values[bottom:top, left:right] = shape_values
+
+        if self.tilemap:
+            tile_material, tile_shape = tile_layers(materials, weights, layers)
+            self._tile_material[bottom:top, left:right] = tile_material
+            self._tile_shape[bottom:top, left:right] = tile_shape
+            self._get_mesh().update(self._tile_material, self._tile_shape)
+        else:
+            self._update_sprites(left, bottom, materials, weights, layers, self._dirty_cells)
+        self._dirty_cells = set()
+        self.revision += 1
+        self.empty = not self._shape_values.any()
+        self._marched = True
+
+        if collision_changed:
+            self.rebuild_collision()
+
+    def compute_geometry(self):
+        """Snapshot this grid for a full rebuild and compute its geometry on the calling thread"""
+        return build_geometry(*self.prepare_build())
+
+    def prepare_build(self):
+        """Arguments for `build_geometry` covering a full rebuild; edits made after this mark the grid dirty again"""
+        self._allocate()
         self._dirty = False
-        height, width = self.state.shape[:2]
-        for instances in self._sprite_cache:
+        self._dirty_cells = set()
+        tex_coords = self._get_mesh().atlas.tex_coords if self.tilemap else None
+        return self.get_halo_state(), self.x, self.y, self.palette, tex_coords
+
+    def apply_geometry(self, geometry):
+        """Main-thread half of a full rebuild: upload quads or sprites and swap in the new collision shapes"""
+        collision_changed = not np.array_equal(self._shape_values, geometry.shape_values)
+        self._shape_values[...] = geometry.shape_values
+        if self.tilemap:
+            self._tile_material[...] = geometry.tile_material
+            self._tile_shape[...] = geometry.tile_shape
+            self._get_mesh().upload(geometry.quads)
+        else:
+            self._update_sprites(0, 0, geometry.materials, geometry.weights, geometry.layers)
+        self.revision += 1
+        self.empty = not self._shape_values.any()
+        self._marched = True
+        if collision_changed:
+            if self.collision_active:
+                self._swap_collision(create_shapes(self._body, geometry.segments))
+            else:
+                self._shapes = []
+                self._collision_stale = True
+
+    def _get_mesh(self):
+        if self._mesh is None:
+            self._mesh = TileMesh(self.x, self.y, self._sprite_batch, palette=self.palette)
+        return self._mesh
+
+    def _update_sprites(self, left, bottom, materials, weights, layers, cells=None):
+        wanted = {}
+        for i, _y, _x in zip(*np.nonzero(weights)):
+            cell = (left + int(_x), bottom + int(_y))
+            wanted.setdefault(cell, []).append((materials[i], int(layers[i, _y, _x])))
+
+        if cells is None:
+            cells = set(wanted) | set(self._sprite_cache)
+        for cell in cells:
+            shapes = wanted.get(cell, [])
+            instances = self._sprite_cache.pop(cell, [])
+            if [(inst.value, inst.shape_value) for inst in instances] == shapes:
+                if instances:
+                    self._sprite_cache[cell] = instances
+                continue
+
             for inst in instances:
-                self.space.remove(inst.body, inst.shape)
                 inst.delete()
-        _new_cache = []
-        for y in range(self.y, height + self.y):
-            for x in range(self.x, width + self.x):
-                cell_weights = [
-                    (1, (x, y)),
-                    (2, (x + 1, y)),
-                    (4, (x + 1, y + 1)),
-                    (8, (x, y + 1))
-                ]
-
-                shape_values = Counter()
-                for weight, pos in cell_weights:
-                    value = self.get_state_at(*pos)
-                    if value != EMPTY_VOXEL:
-                        shape_values[value] += weight
-                total = sum(shape_values.values())
-                instances = []
-                for value, weight in sorted(shape_values.items(), reverse=True):
-                    inst = Voxel.by_color(value, x=x, y=y, value=value, shape_value=total, batch=self._sprite_batch)
-                    self.space.add(inst.body, inst.shape)
-                    total -= weight
-                    if inst:
-                        instances.append(inst)
-                _new_cache.append(instances)
-        self._sprite_cache = _new_cache
+            instances = []
+            for value, shape_value in shapes:
+                instances.append(self.palette.create(value, x=self.x + cell[0], y=self.y + cell[1],
+                                                     shape_value=shape_value, batch=self._sprite_batch))
+            if instances:
+                self._sprite_cache[cell] = instances
+
+    def rebuild_collision(self):
+        """Replace this grid's collision shapes with merged contours built from its current shape values"""
+        if self._body is None:
+            return
+        if not self.collision_active:
+            self._shapes = []
+            self._collision_stale = True
+            return
+        self._collision_stale = False
+        self._swap_collision(create_shapes(self._body, contour_segments(self._shape_values)))
+
+    def build_collision(self):
+        """Build collision shapes from the current state on their own, ahead of the first full rebuild"""
+        if self._body is None:
+            return
+        self._shape_values[...] = march_chunk(self.get_halo_state(), self.palette)[0]
+        self._marched = True
+        self.rebuild_collision()
+
+    def _swap_collision(self, shapes):
+        if self._shapes:
+            self.space.remove(*self._shapes)
+        # a chunk without shapes (empty, or solid with solid neighbours) keeps its body out of the space too
+        if shapes and self._body.space is None:
+            self.space.add(self._body)
+        elif not shapes and self._body.space is not None:
+            self.space.remove(self._body)
+        self.space.add(*shapes)
+        self._shapes = shapes
+
+    def set_collision_active(self, active):
+        """Add this grid's collision shapes to the space or take them out, building them first if stale"""
+        if active == self.collision_active:
+            return
+        self.collision_active = active
+        if self._body is None:
+            return
+        if not active:
+            if self._shapes:
+                self.space.remove(*self._shapes)
+        elif not self._marched:
+            # never built: march the collision now rather than wait for the queued rebuild
+            self.build_collision()
+        elif self._collision_stale:
+            self.rebuild_collision()
+        elif self._shapes:
+            if self._body.space is None:
+                self.space.add(self._body)
+            self.space.add(*self._shapes)
+
+    def own_state(self):
+        """This grid's state, copied first if it is a shared read-only one"""
+        if not self.state.flags.writeable:
+            self.state = np.array(self.state)
+        self._allocate()
+        return self.state
 
     def __setitem__(self, key, value):
-        self._dirty = True
         x, y = key
         _x = x - self.x
         _y = y - self.y
-        self.state[_y, _x] = value
+        self.own_state()[_y, _x] = self.palette.id_of(value)
+        self.modified = True
+        # the edited corner is shared by the 2x2 block of cells below and to the left of it
+        for cell in ((x, y), (x - 1, y), (x, y - 1), (x - 1, y - 1)):
+            self.mark_dirty(*cell)
+
+    def delete(self):
+        """Release this grid's sprites, vertex list and collision shapes"""
+        if self._body is None:
+            if self.scheduler is not None:
+                self.scheduler.discard(self)
+            return
+        for instances in self._sprite_cache.values():
+            for inst in instances:
+                inst.delete()
+        self._sprite_cache = {}
+        if self._mesh is not None:
+            self._mesh.delete()
+        if self._shapes and self.collision_active:
+            self.space.remove(*self._shapes)
+        self._shapes = []
+        if self._body.space is not None:
+            self.space.remove(self._body)
+        self._shape_values[:] = 0
+        self._tile_material[:] = EMPTY
+        self._dirty = True
+        self._marched = False
+        if self.scheduler is not None:
+            self.scheduler.discard(self)
 
     def draw(self):
-        if self._dirty:
+        if self.scheduler is None and self.needs_rebuild:
             self.update_sprite_cache()
-        self._sprite_batch.draw()
+        if not self.empty:
+            self._sprite_batch.draw()
+
+    def bake(self, resolution, baked=None):
+        """Render this grid's geometry into a BakedQuad at `resolution` pixels per voxel, reusing `baked` if it fits"""
+        height, width = self.state.shape[:2]
+        if baked is None or baked.texture.width != width * resolution:
+            if baked is not None:
+                baked.delete()
+            left, bottom = self.x * VOXEL_SIZE, self.y * VOXEL_SIZE
+            baked = BakedQuad(width * resolution, height * resolution,
+                              left, bottom, left + width * VOXEL_SIZE, bottom + height * VOXEL_SIZE)
+        baked.render(self._sprite_batch)
+        baked.revision = self.revision
+        return baked
@@ -0,0 +1,107 @@
+"""
+Pre-built levels stored as a raw, memory-mapped array of material IDs.
+
+    python -m voxels.level import data/images/example_level.png data/levels/example.vxl
+    python -m voxels.level info data/levels/example.vxl
+"""
+import argparse
+import os
+import struct
+import tempfile
+from collections import namedtuple
+
+import numpy as np
+import pyglet
+
+if __name__ == "__main__":
+    # the command line tool never opens a window
+    pyglet.options['shadow_window'] = False
+
+from voxels.palette import default_palette  # noqa: E402
+
+MAGIC = b"VXLV"
+FORMAT_VERSION = 1
+# magic, version, header size, width, height, palette size; the palette colours follow
+_HEADER = struct.Struct("<4sHHIIH")
+# data starts on a page-friendly boundary
+_ALIGN = 64
+
+
+LevelHeader = namedtuple("LevelHeader", ["width", "height", "colors", "offset"])
+
+
+def read_header(filename):
+    with open(filename, "rb") as f:
+        magic, version, offset, width, height, count = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != MAGIC:
+            raise ValueError("{} is not a voxel level".format(filename))
+        if version != FORMAT_VERSION:
+            raise ValueError("unsupported level version {} in {}".format(version, filename))
+        colors = np.frombuffer(f.read(count * 3), dtype=np.uint8).reshape(count, 3)
+    return LevelHeader(width, height, colors, offset)
+
+
+def save_level(filename, state, palette=None):
+    """Write a (height, width) material ID array as a level file, replacing `filename` atomically"""
+    palette = palette or default_palette()
+    height, width = state.shape
+    header = _HEADER.size + palette.colors.nbytes
+    offset = (header + _ALIGN - 1) // _ALIGN * _ALIGN
+
+    directory = os.path.dirname(os.path.abspath(filename))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_filename = tempfile.mkstemp(suffix=".tmp", dir=directory)
+    with os.fdopen(fd, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, offset, width, height, len(palette.colors)))
+        f.write(palette.colors.tobytes())
+        f.write(b"\0" * (offset - header))
+        f.write(np.ascontiguousarray(state, dtype=np.uint8).tobytes())
+    # mkstemp files are private to the owner; levels are ordinary shared assets
+    os.chmod(temp_filename, 0o644)
+    os.replace(temp_filename, filename)
+
+
+def open_level(filename, palette=None, mode="c"):
+    """Map a level file as a (height, width) uint8 array, copy-on-write unless `mode` says otherwise"""
+    palette = palette or default_palette()
+    header = read_header(filename)
+    if not np.array_equal(header.colors, palette.colors[:len(header.colors)]):
+        raise ValueError("{} was written with a different palette".format(filename))
+    return np.memmap(filename, dtype=np.uint8, mode=mode, offset=header.offset,
+                     shape=(header.height, header.width))
+
+
+def import_image(source, filename, palette=None):
+    """Convert a level image (one pixel per voxel, coloured by material) into a level file"""
+    palette = palette or default_palette()
+    image = pyglet.image.load(source).get_image_data()
+    colors = np.frombuffer(image.get_data("BGR", image.width * 3), dtype=np.uint8)
+    state = palette.from_colors(colors.reshape(image.height, image.width, 3))
+    save_level(filename, state, palette)
+    return state.shape
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import", help="convert a PNG level into a level file")
+    import_parser.add_argument("source")
+    import_parser.add_argument("filename")
+    info_parser = commands.add_parser("info", help="print a level file's size and palette")
+    info_parser.add_argument("filename")
+    args = parser.parse_args(argv)
+
+    if args.command == "import":
+        height, width = import_image(args.source, args.filename)
+        print("imported {}x{} level to {}".format(width, height, args.filename))
+    else:
+        header = read_header(args.filename)
+        state = open_level(args.filename, mode="r")
+        counts = np.bincount(state.ravel(), minlength=len(header.colors))
+        print("{}x{} cells, {} materials".format(header.width, header.height, len(header.colors)))
+        for material, (color, count) in enumerate(zip(header.colors.tolist(), counts.tolist())):
+            print("  {} {} {} cells".format(material, tuple(color), count))
+
+
+if __name__ == "__main__":
+    main()
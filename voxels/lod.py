@@ -0,0 +1,98 @@
+from bubblestash.profiler import profiler
+from voxels.cache import ChunkCache
+from voxels.render import BakedQuad, VoxelAtlas
+from voxels.voxel import VOXEL_SIZE
+
+# detail tiers, from closest to furthest
+GRIDS = 0
+BAKED_CHUNKS = 1
+REGIONS = 2
+
+
+class TerrainLOD(object):
+    """Zoomed-out drawing for a VoxelMap from baked chunk textures, or per-region colour maps further out"""
+
+    def __init__(self, terrain, resolution=8, chunk_threshold=12, region_threshold=4, region_size=64,
+                 bakes_per_frame=16, capacity=4096):
+        self.terrain = terrain
+        self.resolution = resolution
+        self.chunk_threshold = chunk_threshold
+        self.region_threshold = region_threshold
+        self.region_size = region_size
+        # a count rather than a time budget: the frame's first render target switch stalls on queued work
+        self.bakes_per_frame = bakes_per_frame
+        self._bakes = ChunkCache(capacity=capacity, on_evict=lambda key, baked: baked.delete())
+        self._regions = {}
+        self._stale_regions = set()
+
+    def tier(self, camera):
+        # the camera's ortho projection squeezes width * zoom world pixels into width screen pixels
+        pixels_per_voxel = VOXEL_SIZE / camera.zoom
+        if pixels_per_voxel <= self.region_threshold:
+            return REGIONS
+        if pixels_per_voxel <= self.chunk_threshold:
+            return BAKED_CHUNKS
+        return GRIDS
+
+    def invalidate(self, left, bottom, right, top):
+        """Mark the regions covering the inclusive cell rectangle for rebuilding the next time they are drawn"""
+        size = self.region_size
+        for row in range(max(bottom, 0) // size, max(top, 0) // size + 1):
+            for column in range(max(left, 0) // size, max(right, 0) // size + 1):
+                if (column, row) in self._regions:
+                    self._stale_regions.add((column, row))
+
+    def draw_chunks(self, grids):
+        self._bakes.pinned = {(grid.x, grid.y) for grid in grids}
+        # bake everything first: switching render targets between draws would stall on what's already queued
+        bakes = 0
+        for grid in grids:
+            if bakes >= self.bakes_per_frame:
+                break
+            key = grid.x, grid.y
+            baked = self._bakes.get(key)
+            # grids never built have nothing to bake yet, empty ones nothing at all
+            if grid.revision and not grid.empty and (baked is None or baked.revision != grid.revision):
+                self._bakes[key] = grid.bake(self.resolution, baked)
+                bakes += 1
+        profiler.add("bakes", bakes)
+
+        for grid in grids:
+            if grid.empty:
+                continue
+            baked = self._bakes.peek((grid.x, grid.y))
+            if baked is not None:
+                baked.draw()
+            elif grid.revision:
+                grid.draw()
+
+    def draw_regions(self, left, bottom, right, top):
+        size = self.region_size
+        height, width = self.terrain.state.shape[:2]
+        for row in range(max(int(bottom), 0) // size, min(int(top), height - 1) // size + 1):
+            for column in range(max(int(left), 0) // size, min(int(right), width - 1) // size + 1):
+                key = column, row
+                region = self._regions.get(key)
+                if region is None or key in self._stale_regions:
+                    region = self._regions[key] = self._build_region(column, row, region)
+                    self._stale_regions.discard(key)
+                region.draw()
+
+    def _build_region(self, column, row, region=None):
+        x, y = column * self.region_size, row * self.region_size
+        block = self.terrain.state[y:y + self.region_size, x:x + self.region_size]
+        height, width = block.shape[:2]
+        if region is None:
+            # each voxel's texel is centred on the corner its state sits at in the marched geometry
+            left, bottom = (x - .5) * VOXEL_SIZE, (y - .5) * VOXEL_SIZE
+            region = BakedQuad(width, height, left, bottom, left + width * VOXEL_SIZE, bottom + height * VOXEL_SIZE)
+        region.upload(VoxelAtlas.get(self.terrain.palette).colors[block])
+        return region
+
+    def clear(self):
+        """Release every baked texture"""
+        self._bakes.clear()
+        for region in self._regions.values():
+            region.delete()
+        self._regions = {}
+        self._stale_regions = set()
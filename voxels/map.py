@@ -1,51 +1,157 @@
+import numpy as np
+
+from bubblestash.profiler import profiler
+from voxels.edit import TerrainEditor
 from voxels.grid import VoxelGrid
+from voxels.lod import GRIDS, REGIONS, TerrainLOD
+from voxels.palette import EMPTY, default_palette
+from voxels.physics import PhysicsLOD
+from voxels.scheduler import RebuildScheduler
+from voxels.voxel import VOXEL_SIZE
+
+
+class VoxelMapGrid(VoxelGrid):
+    """Chunk of a VoxelMap; cells past its own edges are read straight from the map's state"""
+
+    def __init__(self, terrain, *args, **kwargs):
+        self.terrain = terrain
+        super().__init__(*args, **kwargs)
+
+    def get_state_at(self, x, y):
+        return self.terrain[x, y]
+
+    def own_state(self):
+        # a view into the map's array, which edits must keep writing through to
+        self._allocate()
+        return self.state
+
+    def get_halo_state(self):
+        # neighbouring chunks may not exist yet, but their cells are always in the map's array
+        height, width = self.state.shape[:2]
+        padded = np.zeros((height + 1, width + 1), dtype=np.uint8)
+        block = self.terrain.state[self.y:self.y + height + 1, self.x:self.x + width + 1]
+        padded[:block.shape[0], :block.shape[1]] = block
+        return padded
+
+    def mark_dirty(self, x, y):
+        super().mark_dirty(x, y)
+        if self.terrain.lod is not None:
+            self.terrain.lod.invalidate(x, y, x, y)
+
+    def mark_dirty_rect(self, left, bottom, right, top):
+        super().mark_dirty_rect(left, bottom, right, top)
+        if self.terrain.lod is not None:
+            self.terrain.lod.invalidate(left, bottom, right - 1, top - 1)
 
 
-class VoxelMap(object):
+class VoxelMap(TerrainEditor, PhysicsLOD):
+    """Fixed-size terrain held in one material ID array, drawn as chunks created the first time they are needed"""
 
-    def __init__(self, state, space, grid_width=8, grid_height=8, cell_height=32, cell_width=32):
+    def __init__(self, state, space, grid_width=8, grid_height=8, cell_height=32, cell_width=32, tilemap=True,
+                 palette=None, scheduler=None, collision_radius=4, collision_margin=4, lod=True):
+        self.palette = palette or default_palette()
+        if state.ndim == 3:
+            state = self.palette.from_colors(state)
+        self.state = state
         self.height, self.width = state.shape[:2]
         self.grid_width = grid_width
         self.grid_height = grid_height
         self.cell_width = cell_width
         self.cell_height = cell_height
         self.space = space
+        self.tilemap = tilemap
+        self.scheduler = scheduler or RebuildScheduler()
+        self.collision_radius = collision_radius
+        self.collision_margin = collision_margin
+        self.lod = TerrainLOD(self) if lod else None
 
-        self._grids = []
-
-        _prev_row = None
-        for y in range(0, self.height, grid_height):
-            row = []
-            _prev_grid = None
-            for i, x in enumerate(range(0, self.width, grid_width)):
-                grid_state = state[y:y + self.grid_height, x:x + self.grid_width]
-                grid = VoxelGrid(x, y, self.grid_width, self.grid_height, space=self.space, state=grid_state)
-                if _prev_grid is not None:
-                    _prev_grid.neighbor_x = grid
-                if _prev_row is not None:
-                    _prev_row[i].neighbor_y = grid
-                _prev_grid = grid
-                row.append(grid)
-            self._grids.extend(row)
-            _prev_row = row
-
-        for grid in reversed(self._grids):
-            grid.update_sprite_cache()
+        # chunk index: chunk (column, row) covers cells from (column * grid_width, row * grid_height)
+        self.columns = -(-self.width // grid_width)
+        self.rows = -(-self.height // grid_height)
+        self._grids = {}
+
+        if not self.physics_lod:
+            # collision_radius=None turns physics LOD off, so the whole map is made solid up front
+            for row in range(self.rows):
+                for column in range(self.columns):
+                    grid = self._get_grid(column, row)
+                    self.scheduler.discard(grid)
+                    grid.build_collision()
+
+    def _get_grid(self, column, row):
+        grid = self._grids.get((column, row))
+        if grid is None:
+            x, y = column * self.grid_width, row * self.grid_height
+            grid = VoxelMapGrid(self, x, y, self.grid_width, self.grid_height, space=self.space,
+                                state=self.state[y:y + self.grid_height, x:x + self.grid_width],
+                                tilemap=self.tilemap, palette=self.palette, scheduler=self.scheduler,
+                                collision=not self.physics_lod)
+            self._grids[column, row] = grid
+        return grid
 
     def get_grid_at(self, x, y):
-        i = y // self.grid_height * (self.width // self.grid_height) + (x // self.grid_width)
-        if 0 <= i < len(self._grids):
-            return self._grids[i]
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self._get_grid(x // self.grid_width, y // self.grid_height)
+
+    def grids_in_rect(self, left, bottom, right, top):
+        """Grids overlapping the inclusive cell rectangle, creating any not touched before"""
+        col_start = max(int(left) // self.grid_width, 0)
+        col_end = min(int(right) // self.grid_width, self.columns - 1)
+        row_start = max(int(bottom) // self.grid_height, 0)
+        row_end = min(int(top) // self.grid_height, self.rows - 1)
+        for row in range(row_start, row_end + 1):
+            for column in range(col_start, col_end + 1):
+                yield self._get_grid(column, row)
+
+    def warm_up(self, x, y, radius):
+        """Create and build every grid within `radius` cells of cell (x, y) now, ahead of the first frame"""
+        for grid in list(self.grids_in_rect(x - radius, y - radius, x + radius, y + radius)):
+            self.scheduler.discard(grid)
+            if grid.needs_rebuild:
+                grid.update_sprite_cache()
+
+    def __getitem__(self, key):
+        x, y = key
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return int(self.state[y, x])
+        return EMPTY
+
+    def stats(self):
+        return {"chunks": len(self._grids), "total_chunks": self.columns * self.rows}
+
+    def close(self):
+        """Stop the rebuild scheduler's worker threads and release baked textures"""
+        self.scheduler.close()
+        if self.lod is not None:
+            self.lod.clear()
+
+    def rebuild_collision(self):
+        for grid in self._grids.values():
+            grid.rebuild_collision()
 
-    def draw(self, camera):
-        left, right, bottom, top = camera.scaled_bounds() // 32
+    def draw(self, camera, focus=None):
+        """Draw the visible grids after spending this frame's rebuild budget, nearest `focus` first"""
+        left, right, bottom, top = camera.scaled_bounds() // VOXEL_SIZE
+        tier = self.lod.tier(camera) if self.lod is not None else GRIDS
+        if tier == REGIONS:
+            # far enough out that no grid needs to exist to be drawn
+            self.scheduler.run(focus or camera.center())
+            with profiler.phase("draw_terrain"):
+                self.lod.draw_regions(left, bottom, right, top)
+            return
 
-        for grid in self._grids:
-            far_x = grid.x + grid.width
-            far_y = grid.y + grid.height
-            if (left <= grid.x <= right or left <= far_x <= right) and \
-                    (bottom <= grid.y <= top or bottom <= far_y <= top):
-                grid.draw()
+        grids = list(self.grids_in_rect(left, bottom, right, top))
+        for grid in grids:
+            if grid.needs_rebuild:
+                # grids only built for collision join the queue once they are on screen
+                self.scheduler.queue(grid)
+        self.scheduler.run(focus or camera.center(), visible=grids)
+        with profiler.phase("draw_terrain"):
+            if tier == GRIDS:
+                for grid in grids:
+                    grid.draw()
+            else:
+                self.lod.draw_chunks(grids)
 
     def __setitem__(self, key, value):
         x, y = key
@@ -53,12 +159,11 @@ class VoxelMap(object):
         if grid:
             grid[x, y] = value
 
-            if x > 0 and x % self.grid_width == 0:
-                o_grid = self.get_grid_at(x - 1, y)
-                o_grid._dirty = True
-                if y > 0 and y % self.grid_height == 0:
-                    o_grid = self.get_grid_at(x - 1, y - 1)
-                    o_grid._dirty = True
-            if y > 0 and y % self.grid_height == 0:
-                o_grid = self.get_grid_at(x - 1, y - 1)
-                o_grid._dirty = True
+            # cells left of and below the edit share its corner and may live in neighbouring grids; ones
+            # never created will read the new state when they are
+            for cell_x, cell_y in ((x - 1, y), (x, y - 1), (x - 1, y - 1)):
+                if cell_x < 0 or cell_y < 0:
+                    continue
+                o_grid = self._grids.get((cell_x // self.grid_width, cell_y // self.grid_height))
+                if o_grid is not None and o_grid is not grid:
+                    o_grid.mark_dirty(cell_x, cell_y)
@@ -0,0 +1,54 @@
+import numpy as np
+
+from voxels.palette import default_palette
+
+
+def corner_mask(solid):
+    """Marching-squares mask of every cell of a corner grid, weighted 1, 2, 4, 8 from bottom-left anticlockwise"""
+    solid = solid.astype(np.uint8)
+    return solid[:-1, :-1] | solid[:-1, 1:] << 1 | solid[1:, 1:] << 2 | solid[1:, :-1] << 3
+
+
+def march(padded, palette=None):
+    """(shape_values, materials, weights) for a chunk's material IDs padded with its one-cell halo"""
+    palette = palette or default_palette()
+    height, width = padded.shape[0] - 1, padded.shape[1] - 1
+    present = set(np.unique(padded).tolist())
+    materials = [material for material in palette.layer_order if material in present]
+
+    weights = np.zeros((len(materials), height, width), dtype=np.uint8)
+    for i, material in enumerate(materials):
+        weights[i] = corner_mask(padded == material)
+    shape_values = weights.sum(axis=0, dtype=np.uint8)
+    return shape_values, materials, weights
+
+
+def march_uniform(padded, material, palette=None):
+    """`march` for a chunk whose own cells all hold `material`, marching only the edges touching the halo"""
+    palette = palette or default_palette()
+    height, width = padded.shape[0] - 1, padded.shape[1] - 1
+    if (padded[-1] == material).all() and (padded[:, -1] == material).all():
+        # the halo matches too: every cell is full, or, for empty space, there is nothing at all
+        materials = [material] if material in palette.layer_order else []
+        weights = np.full((len(materials), height, width), 15, dtype=np.uint8)
+        return weights.sum(axis=0, dtype=np.uint8), materials, weights
+
+    edges = [(np.s_[height - 1:, :], march(padded[height - 1:, :], palette)),
+             (np.s_[:, width - 1:], march(padded[:, width - 1:], palette))]
+    present = {material}.union(*(edge_materials for _, (_, edge_materials, _) in edges))
+    materials = [m for m in palette.layer_order if m in present]
+
+    weights = np.zeros((len(materials), height, width), dtype=np.uint8)
+    if material in materials:
+        weights[materials.index(material)] = 15
+    for region, (_, edge_materials, edge_weights) in edges:
+        weights[(slice(None),) + region] = 0
+        for i, edge_material in enumerate(edge_materials):
+            weights[(materials.index(edge_material),) + region] = edge_weights[i]
+    shape_values = weights.sum(axis=0, dtype=np.uint8)
+    return shape_values, materials, weights
+
+
+def layer_shapes(shape_values, weights):
+    """Shape value each stacked material's voxel is drawn with"""
+    return shape_values - np.cumsum(weights, axis=0, dtype=np.uint8) + weights
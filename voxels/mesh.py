@@ -0,0 +1,61 @@
+"""Pure geometry building for voxel chunks, free of OpenGL and pymunk so it can run off the main thread"""
+from collections import namedtuple
+
+import numpy as np
+
+from voxels.collision import contour_segments
+from voxels.marching import layer_shapes, march, march_uniform
+from voxels.uniform import uniform_material
+from voxels.voxel import VOXEL_SIZE
+
+FRAMES_PER_VOXEL = 16
+MAX_LAYERS = 4
+_QUAD_INDICES = np.array([0, 1, 2, 0, 2, 3])
+
+ChunkGeometry = namedtuple("ChunkGeometry", [
+    "shape_values", "materials", "weights", "layers", "tile_material", "tile_shape", "quads", "segments"
+])
+
+
+def tile_layers(materials, weights, layers):
+    """Per-cell material and shape slots, (height, width, MAX_LAYERS) each, filled in layer order"""
+    height, width = weights.shape[1:]
+    tile_material = np.zeros((height, width, MAX_LAYERS), dtype=np.uint8)
+    tile_shape = np.zeros((height, width, MAX_LAYERS), dtype=np.uint8)
+    rank = np.cumsum(weights > 0, axis=0) - 1
+    i, y, x = np.nonzero(weights)
+    tile_material[y, x, rank[i, y, x]] = np.array(materials, dtype=np.uint8)[i]
+    tile_shape[y, x, rank[i, y, x]] = layers[i, y, x]
+    return tile_material, tile_shape
+
+
+def quad_arrays(x, y, tile_material, tile_shape, tex_coords):
+    """Vertex, texture coordinate and index arrays for every filled tile slot of the chunk at (x, y)"""
+    ys, xs, slots = np.nonzero(tile_material)
+    count = len(ys)
+    left = (x + xs) * VOXEL_SIZE
+    bottom = (y + ys) * VOXEL_SIZE
+    right = left + VOXEL_SIZE
+    top = bottom + VOXEL_SIZE
+    vertices = np.stack([left, bottom, right, bottom, right, top, left, top], axis=1).ravel()
+    tex = tex_coords[tile_material[ys, xs, slots], tile_shape[ys, xs, slots]].ravel()
+    indices = (np.arange(count)[:, None] * 4 + _QUAD_INDICES).ravel()
+    return vertices, tex, indices
+
+
+def march_chunk(padded, palette):
+    """`march` for a chunk's padded state, only marching the halo edges of single-material chunks"""
+    material = uniform_material(padded[:-1, :-1])
+    if material is None:
+        return march(padded, palette)
+    return march_uniform(padded, material, palette)
+
+
+def build_geometry(padded, x, y, palette, tex_coords=None):
+    """Everything a full rebuild of the chunk at (x, y) needs, from its state plus one-cell halo"""
+    shape_values, materials, weights = march_chunk(padded, palette)
+    layers = layer_shapes(shape_values, weights)
+    tile_material, tile_shape = tile_layers(materials, weights, layers)
+    quads = quad_arrays(x, y, tile_material, tile_shape, tex_coords) if tex_coords is not None else None
+    return ChunkGeometry(shape_values, materials, weights, layers, tile_material, tile_shape, quads,
+                         contour_segments(shape_values))
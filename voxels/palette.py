@@ -0,0 +1,64 @@
+import numpy as np
+
+from voxels.voxel import EMPTY_VOXEL, Voxel
+
+EMPTY = 0
+
+
+def _pack(colors):
+    colors = np.asarray(colors).astype(np.uint32)
+    return colors[..., 0] << 16 | colors[..., 1] << 8 | colors[..., 2]
+
+
+class Palette(object):
+    """Maps uint8 material IDs (0 is empty space) to voxel classes and colours"""
+
+    def __init__(self, voxel_classes):
+        self.voxel_classes = [None] + list(voxel_classes)
+        self.colors = np.array([EMPTY_VOXEL] + [cls.color for cls in voxel_classes], dtype=np.uint8)
+
+        keys = _pack(self.colors)
+        self._sorted_keys = np.sort(keys)
+        self._ids_by_key = np.argsort(keys).astype(np.uint8)
+        self._ids_by_color = {tuple(color): i for i, color in enumerate(self.colors.tolist())}
+        self._ids_by_class = {cls: i for i, cls in enumerate(self.voxel_classes) if cls is not None}
+
+        # stacked materials are layered highest colour first, as they were when state was stored as colours
+        self.layer_order = sorted(range(1, len(self.voxel_classes)), key=lambda i: tuple(self.colors[i]),
+                                  reverse=True)
+
+    def __len__(self):
+        return len(self.voxel_classes)
+
+    def id_of(self, value):
+        """Material ID for an ID, a colour triple or a Voxel subclass; unknown colours are empty"""
+        if isinstance(value, (int, np.integer)):
+            return int(value)
+        if isinstance(value, type):
+            return self._ids_by_class[value]
+        return self._ids_by_color.get(tuple(np.asarray(value).astype(int).tolist()), EMPTY)
+
+    def from_colors(self, colors):
+        """(height, width, 3) colour array to a (height, width) ID array"""
+        keys = _pack(colors)
+        index = np.clip(np.searchsorted(self._sorted_keys, keys), 0, len(self._sorted_keys) - 1)
+        ids = self._ids_by_key[index]
+        ids[self._sorted_keys[index] != keys] = EMPTY
+        return ids
+
+    def to_colors(self, ids):
+        return self.colors[ids]
+
+    def create(self, material, x, y, **kwargs):
+        return self.voxel_classes[material](x, y, value=material, **kwargs)
+
+
+_default_palette = None
+
+
+def default_palette():
+    """Palette of every Voxel subclass, built the first time it is needed"""
+    global _default_palette
+    if _default_palette is None:
+        _default_palette = Palette(Voxel.__subclasses__())
+    return _default_palette
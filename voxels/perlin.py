@@ -3,29 +3,70 @@ from operator import itemgetter
 
 import numpy as np
 
-from voxels.voxel import EMPTY_VOXEL
+from voxels.palette import EMPTY, default_palette
+
+
+class NoiseGenerator(object):
+    """Seeded, fractal Perlin noise sampled in world coordinates, independent of NumPy's global RNG"""
+    _permutations = {}
+
+    def __init__(self, seed=0, octaves=1, persistence=0.5, lacunarity=2.0):
+        self.seed = seed
+        self.octaves = octaves
+        self.persistence = persistence
+        self.lacunarity = lacunarity
+
+    @classmethod
+    def permutation(cls, seed):
+        table = cls._permutations.get(seed)
+        if table is None:
+            p = np.random.RandomState(seed).permutation(256)
+            table = cls._permutations[seed] = np.concatenate([p, p])
+        return table
+
+    def layer_seed(self, layer):
+        return (self.seed * 1000003 ^ layer * 2654435761) & 0xFFFFFFFF
+
+    def sample(self, x, y, layers=(0,)):
+        """Noise for every layer key in `layers` at once, shaped (len(layers),) + x.shape"""
+        tables = np.stack([self.permutation(self.layer_seed(layer)) for layer in layers])
+        total = np.zeros((len(layers),) + np.shape(x))
+        amplitude = 1.
+        frequency = 1.
+        norm = 0.
+        for octave in range(self.octaves):
+            # offset each octave so they don't all share a lattice point at the origin
+            shift = octave * 17.31
+            total += amplitude * _perlin(tables, x * frequency + shift, y * frequency + shift)
+            norm += amplitude
+            amplitude *= self.persistence
+            frequency *= self.lacunarity
+        return total / norm
 
 
 def perlin(x, y, seed=0):
-    # permutation table
-    np.random.seed(seed)
-    p = np.arange(256, dtype=int)
-    np.random.shuffle(p)
-    p = np.stack([p, p]).flatten()
+    return _perlin(NoiseGenerator.permutation(seed)[None], x, y)[0]
+
+
+def _perlin(tables, x, y):
+    """Perlin noise for a stack of (layers, 512) permutation tables"""
+    rows = np.arange(len(tables)).reshape((-1,) + (1,) * np.ndim(x))
     # coordinates of the top-left
-    xi = x.astype(int)
-    yi = y.astype(int)
+    xi = np.floor(x).astype(int)
+    yi = np.floor(y).astype(int)
     # internal coordinates
     xf = x - xi
     yf = y - yi
+    xi &= 255
+    yi &= 255
     # fade factors
     u = fade(xf)
     v = fade(yf)
     # noise components
-    n00 = gradient(p[p[xi] + yi], xf, yf)
-    n01 = gradient(p[p[xi] + yi + 1], xf, yf - 1)
-    n11 = gradient(p[p[xi + 1] + yi + 1], xf - 1, yf - 1)
-    n10 = gradient(p[p[xi + 1] + yi], xf - 1, yf)
+    n00 = gradient(tables[rows, tables[rows, xi] + yi], xf, yf)
+    n01 = gradient(tables[rows, tables[rows, xi] + yi + 1], xf, yf - 1)
+    n11 = gradient(tables[rows, tables[rows, xi + 1] + yi + 1], xf - 1, yf - 1)
+    n10 = gradient(tables[rows, tables[rows, xi + 1] + yi], xf - 1, yf)
     # combine noises
     x1 = lerp(n00, n10, u)
     x2 = lerp(n01, n11, u)  # FIX1: I was using n10 instead of n01
@@ -46,21 +87,26 @@ def gradient(h, x, y):
     "grad converts h to the right gradient vector and return the dot product with (x,y)"
     vectors = np.array([[0, 1], [0, -1], [1, 0], [-1, 0]])
     g = vectors[h % 4]
-    return g[:, :, 0] * x + g[:, :, 1] * y
-
-
-def generate_random_map(width, height, voxels, base_voxel=None):
-    map_img = np.ones((width, height, 3))
-    if base_voxel and base_voxel != EMPTY_VOXEL:
-        map_img *= base_voxel.color
-    else:
-        map_img *= EMPTY_VOXEL
-
-    for voxel_cls, scarcity in sorted(voxels.items(), key=itemgetter(1), reverse=True):
-        lin_w = np.linspace(0, 5, width, endpoint=False)
-        lin_h = np.linspace(0, 5, height, endpoint=False)
-        x, y = np.meshgrid(lin_w, lin_h)
-        img = (perlin(x, y, seed=random.randint(0, 2 ** 32 - 1)) * 255).astype(np.uint8)
-        map_img[img > 255 - 255 * scarcity] = voxel_cls.color
+    return g[..., 0] * x + g[..., 1] * y
+
+
+def generate_random_map(width, height, voxels, base_voxel=None, palette=None, origin=(0, 0), noise=None,
+                        scale=None):
+    """Material ID map of `voxels` scattered by noise sampled from world cell `origin`"""
+    palette = palette or default_palette()
+    noise = noise or NoiseGenerator(seed=random.randint(0, 2 ** 32 - 1))
+    scale = scale or 5 / width
+    map_img = np.full((height, width), palette.id_of(base_voxel) if base_voxel is not None else EMPTY,
+                      dtype=np.uint8)
+    if not voxels:
+        return map_img
+
+    x, y = np.meshgrid((origin[0] + np.arange(width)) * scale, (origin[1] + np.arange(height)) * scale)
+    layers = sorted(voxels.items(), key=itemgetter(1), reverse=True)
+    materials = [palette.id_of(voxel_cls) for voxel_cls, _ in layers]
+    # negative noise wraps around rather than clamping, as the original uint8 cast did
+    levels = np.trunc(noise.sample(x, y, materials) * 255).astype(np.int64) % 256
+    for material, (_, scarcity), level in zip(materials, layers, levels):
+        map_img[level > 255 - 255 * scarcity] = material
 
     return map_img
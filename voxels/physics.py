@@ -0,0 +1,67 @@
+import math
+
+import pymunk
+
+from voxels.voxel import VOXEL_SIZE
+
+
+class PhysicsLOD(object):
+    """Collision only for grids within `collision_radius` cells of a dynamic body, see `update_collision`"""
+    collision_radius = None
+    collision_margin = 4
+    # seconds of travel the activation area is stretched by along each body's velocity
+    collision_lookahead = 0.25
+    _collision_grids = None
+
+    @property
+    def physics_lod(self):
+        return self.collision_radius is not None
+
+    def _collision_rect(self, body, radius):
+        x, y = body.position
+        vx, vy = body.velocity * self.collision_lookahead
+        left, right = min(x, x + vx) / VOXEL_SIZE - radius, max(x, x + vx) / VOXEL_SIZE + radius
+        bottom, top = min(y, y + vy) / VOXEL_SIZE - radius, max(y, y + vy) / VOXEL_SIZE + radius
+        return math.floor(left), math.floor(bottom), math.floor(right), math.floor(top)
+
+    def _collision_grids_in_rect(self, left, bottom, right, top):
+        return self.grids_in_rect(left, bottom, right, top)
+
+    def update_collision(self, bodies):
+        """Activate collision for grids near the dynamic `bodies` and deactivate it for grids left behind"""
+        if not self.physics_lod:
+            return
+        if self._collision_grids is None:
+            self._collision_grids = {}
+
+        near = {}
+        keep = {}
+        for body in bodies:
+            if body.body_type != pymunk.Body.DYNAMIC:
+                continue
+            for grid in self._collision_grids_in_rect(*self._collision_rect(body, self.collision_radius)):
+                near[id(grid)] = grid
+            for grid in self._collision_grids_in_rect(
+                    *self._collision_rect(body, self.collision_radius + self.collision_margin)):
+                keep[id(grid)] = grid
+
+        for key, grid in list(self._collision_grids.items()):
+            if key not in keep:
+                grid.set_collision_active(False)
+                del self._collision_grids[key]
+        for key, grid in near.items():
+            grid.set_collision_active(True)
+            self._collision_grids[key] = grid
+
+    def follow(self, stage, flush=False):
+        """Update collision for `stage`'s actors before each of its ticks, finishing queued rebuilds first if `flush`"""
+        def before_tick():
+            if flush:
+                # collision from edits then changes at the same tick however fast frames are drawn
+                self.scheduler.flush()
+            self.update_collision(actor.body for actor in stage.actors)
+        stage.add_tick_callback(before_tick)
+
+    def collision_grids(self):
+        """Grids whose collision is currently switched on by `update_collision`"""
+        return list((self._collision_grids or {}).values())
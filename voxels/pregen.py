@@ -0,0 +1,95 @@
+"""
+Bake a rectangle of VoxelGridStore chunks to disk ahead of time.
+
+    python -m voxels.pregen --seed 1234 --chunks -16 -4 16 4
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pyglet
+
+pyglet.options['shadow_window'] = False
+
+from voxels import voxel  # noqa: E402
+from voxels.store import VoxelGridStore  # noqa: E402
+
+DEFAULT_VOXELS = {
+    voxel.DirtVoxel: 1.0,
+    voxel.MarbleVoxel: 0.1,
+    voxel.DiamondVoxel: 0.001,
+    voxel.IronVoxel: 0.06,
+}
+
+_store = None
+
+
+def _init_worker(store_kwargs):
+    global _store
+    _store = VoxelGridStore(space=None, **store_kwargs)
+
+
+def _generate_chunk(chunk):
+    return _store.gen_state(*chunk)
+
+
+def parse_voxels(values):
+    voxels = {}
+    for value in values:
+        name, scarcity = value.split("=")
+        voxels[getattr(voxel, name)] = float(scarcity)
+    return voxels
+
+
+def pregenerate(chunks_x, chunks_y, workers=None, report_every=2.0, **store_kwargs):
+    """Generate every missing chunk in the given chunk index ranges; returns (generated, skipped, seconds)"""
+    grid_width = store_kwargs.get("grid_width", 8)
+    grid_height = store_kwargs.get("grid_height", 8)
+    chunks = [(cx * grid_width, cy * grid_height) for cy in chunks_y for cx in chunks_x]
+    store = VoxelGridStore(space=None, **store_kwargs)
+    missing = [chunk for chunk in chunks if not store.has_state(*chunk)]
+
+    generated = 0
+    start = last_report = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(store_kwargs,)) as executor:
+        # workers only generate; chunks share region files, so this process alone writes them
+        for chunk, state in zip(missing, executor.map(_generate_chunk, missing, chunksize=8)):
+            store[chunk] = state
+            generated += 1
+            now = time.perf_counter()
+            if now - last_report >= report_every:
+                last_report = now
+                print("{}/{} chunks, {:.1f} generated/s".format(generated, len(missing), generated / (now - start)))
+    store.close()
+    return generated, len(chunks) - len(missing), time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--seed", type=int, required=True,
+                        help="world seed; the game must use the same seed, grid size and voxels")
+    parser.add_argument("--chunks", type=int, nargs=4, required=True, metavar=("X0", "Y0", "X1", "Y1"),
+                        help="chunk index range to fill, end exclusive")
+    parser.add_argument("--state-dir", default="./data/state")
+    parser.add_argument("--grid-width", type=int, default=32)
+    parser.add_argument("--grid-height", type=int, default=32)
+    parser.add_argument("--octaves", type=int, default=1)
+    parser.add_argument("--voxel", action="append", default=[], metavar="NAME=SCARCITY",
+                        help="voxel class and scarcity, e.g. DirtVoxel=1.0 (repeatable)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--storage", choices=("region", "png"), default="region")
+    args = parser.parse_args(argv)
+
+    x0, y0, x1, y1 = args.chunks
+    generated, skipped, seconds = pregenerate(
+        range(x0, x1), range(y0, y1), workers=args.workers,
+        state_dir=args.state_dir, grid_width=args.grid_width, grid_height=args.grid_height,
+        known_voxels=parse_voxels(args.voxel) or DEFAULT_VOXELS, seed=args.seed, octaves=args.octaves,
+        storage=args.storage)
+    print("generated {} chunks, skipped {} existing in {:.2f}s ({:.1f} chunks/s)".format(
+        generated, skipped, seconds, generated / seconds if seconds else 0.))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""
+Region files: many VoxelGridStore chunks packed into one file, each compressed on its own.
+
+    python -m voxels.region migrate data/state
+    python -m voxels.region info data/state/0_0_8_8.region
+"""
+import argparse
+import os
+import re
+import struct
+import threading
+import zlib
+
+import numpy as np
+import pyglet
+
+if __name__ == "__main__":
+    # the command line tool never opens a window
+    pyglet.options['shadow_window'] = False
+
+from voxels.cache import ChunkCache  # noqa: E402
+from voxels.palette import default_palette  # noqa: E402
+
+MAGIC = b"VXRG"
+FORMAT_VERSION = 1
+# magic, version, chunks per side, chunk width, chunk height, palette size; the palette colours follow
+_HEADER = struct.Struct("<4sHHHHH")
+# offset, compressed length and space reserved at that offset; a zero length means no chunk
+_ENTRY = struct.Struct("<QII")
+# chunk slots are rounded up to this, so a freed slot fits a chunk that compresses a little worse
+_ALIGN = 64
+
+
+class RegionFile(object):
+    """One region file, created with an empty index if it doesn't exist yet. Not thread-safe on its own."""
+
+    def __init__(self, filename, size=32, width=8, height=8, palette=None):
+        self.filename = filename
+        self.size = size
+        self.width = width
+        self.height = height
+        self.palette = palette or default_palette()
+        if os.path.exists(filename):
+            self._file = open(filename, "r+b")
+            self._read_header()
+        else:
+            self._file = open(filename, "w+b")
+            self._write_header()
+
+    def _read_header(self):
+        magic, version, size, width, height, count = _HEADER.unpack(self._file.read(_HEADER.size))
+        if magic != MAGIC:
+            raise ValueError("{} is not a region file".format(self.filename))
+        if version != FORMAT_VERSION:
+            raise ValueError("unsupported region version {} in {}".format(version, self.filename))
+        if (size, width, height) != (self.size, self.width, self.height):
+            raise ValueError("{} holds {}x{} regions of {}x{} chunks".format(self.filename, size, size, width, height))
+        colors = np.frombuffer(self._file.read(count * 3), dtype=np.uint8).reshape(count, 3)
+        if not np.array_equal(colors, self.palette.colors[:count]):
+            raise ValueError("{} was written with a different palette".format(self.filename))
+        self._index_offset = self._file.tell()
+        index = self._file.read(self.size * self.size * _ENTRY.size)
+        self._index = [list(entry) for entry in _ENTRY.iter_unpack(index)]
+        self._end = max([self._index_offset + len(self._index) * _ENTRY.size] +
+                        [offset + capacity for offset, _, capacity in self._index])
+        # every gap between the slots the index points at is free
+        self._free = []
+        position = self._index_offset + len(self._index) * _ENTRY.size
+        for offset, length, capacity in sorted(self._index):
+            if not length:
+                continue
+            if offset > position:
+                self._free.append([position, offset - position])
+            position = max(position, offset + capacity)
+
+    def _write_header(self):
+        colors = self.palette.colors
+        self._file.write(_HEADER.pack(MAGIC, FORMAT_VERSION, self.size, self.width, self.height, len(colors)))
+        self._file.write(colors.tobytes())
+        self._index_offset = self._file.tell()
+        self._index = [[0, 0, 0] for _ in range(self.size * self.size)]
+        self._file.write(b"\0" * (len(self._index) * _ENTRY.size))
+        self._file.flush()
+        self._end = self._file.tell()
+        self._free = []
+
+    def __contains__(self, key):
+        column, row = key
+        return self._index[row * self.size + column][1] > 0
+
+    def chunks(self):
+        """(column, row) of every chunk stored"""
+        return [(i % self.size, i // self.size) for i, (_, length, _) in enumerate(self._index) if length]
+
+    def read(self, column, row):
+        offset, length, _ = self._index[row * self.size + column]
+        if not length:
+            return None
+        self._file.seek(offset)
+        data = zlib.decompress(self._file.read(length))
+        return np.frombuffer(data, dtype=np.uint8).reshape(self.height, self.width).copy()
+
+    def write(self, column, row, state):
+        data = zlib.compress(np.ascontiguousarray(state, dtype=np.uint8).tobytes())
+        i = row * self.size + column
+        old_offset, old_length, old_capacity = self._index[i]
+        offset, capacity = self._allocate(-(-len(data) // _ALIGN) * _ALIGN)
+        # never over the chunk's current slot: until the index entry is rewritten it still points at the old data
+        self._file.seek(offset)
+        self._file.write(data)
+        self._file.flush()
+        self._index[i] = [offset, len(data), capacity]
+        self._file.seek(self._index_offset + i * _ENTRY.size)
+        self._file.write(_ENTRY.pack(offset, len(data), capacity))
+        self._file.flush()
+        if old_length:
+            self._release(old_offset, old_capacity)
+
+    def _allocate(self, capacity):
+        """(offset, capacity) of the first free slot that fits `capacity` bytes, else of new space at the end"""
+        for i, (offset, free) in enumerate(self._free):
+            if free >= capacity:
+                if free == capacity:
+                    del self._free[i]
+                else:
+                    self._free[i] = [offset + capacity, free - capacity]
+                return offset, capacity
+        offset = self._end
+        self._end += capacity
+        return offset, capacity
+
+    def _release(self, offset, capacity):
+        """Return a slot to the free list, merged with free neighbours"""
+        self._free.append([offset, capacity])
+        self._free.sort()
+        merged = [self._free[0]]
+        for offset, capacity in self._free[1:]:
+            if merged[-1][0] + merged[-1][1] == offset:
+                merged[-1][1] += capacity
+            else:
+                merged.append([offset, capacity])
+        self._free = merged
+
+    def unused_bytes(self):
+        """Space taken by slots no chunk points at any more, or that chunks don't fill"""
+        used = sum(length for _, length, _ in self._index)
+        return self._end - self._index_offset - len(self._index) * _ENTRY.size - used
+
+    def close(self):
+        self._file.close()
+
+
+class RegionStorage(object):
+    """VoxelGridStore chunks kept in region files under `state_dir`, safe to use from loader threads"""
+
+    def __init__(self, state_dir, grid_width=8, grid_height=8, palette=None, size=32, max_open=64):
+        self.state_dir = state_dir
+        self.grid_width = grid_width
+        self.grid_height = grid_height
+        self.palette = palette or default_palette()
+        self.size = size
+        self._regions = ChunkCache(capacity=max_open, on_evict=lambda key, region: region.close())
+        self._lock = threading.Lock()
+
+    def _get_filename(self, region_x, region_y):
+        filename = "{}_{}_{}_{}.region".format(region_x, region_y, self.grid_width, self.grid_height)
+        return os.path.join(self.state_dir, filename)
+
+    def _locate(self, x, y, create=False):
+        """(region file, column, row) holding the chunk at (x, y); no file if there is none and not `create`"""
+        column, row = x // self.grid_width, y // self.grid_height
+        key = column // self.size, row // self.size
+        region = self._regions.get(key)
+        if region is None:
+            filename = self._get_filename(*key)
+            if create:
+                os.makedirs(self.state_dir, exist_ok=True)
+            elif not os.path.exists(filename):
+                return None, None, None
+            region = self._regions[key] = RegionFile(filename, self.size, self.grid_width, self.grid_height,
+                                                     self.palette)
+        return region, column % self.size, row % self.size
+
+    def has(self, x, y):
+        with self._lock:
+            region, column, row = self._locate(x, y)
+            return region is not None and (column, row) in region
+
+    def read(self, x, y):
+        with self._lock:
+            region, column, row = self._locate(x, y)
+            return region.read(column, row) if region is not None else None
+
+    def write(self, x, y, state):
+        with self._lock:
+            region, column, row = self._locate(x, y, create=True)
+            region.write(column, row, state)
+
+    def close(self):
+        with self._lock:
+            self._regions.clear()
+
+
+_PNG_CHUNK = re.compile(r"^(-?\d+)_(-?\d+)_(\d+)_(\d+)\.png$")
+
+
+def migrate(state_dir, palette=None, size=32, delete=False):
+    """Copy every `x_y_w_h.png` chunk in `state_dir` into region files; returns (imported, skipped)"""
+    from voxels.store import PNGStorage
+
+    palette = palette or default_palette()
+    chunks = {}
+    for filename in sorted(os.listdir(state_dir)):
+        match = _PNG_CHUNK.match(filename)
+        if match:
+            x, y, width, height = map(int, match.groups())
+            chunks.setdefault((width, height), []).append((x, y))
+
+    imported = skipped = 0
+    for (width, height), origins in chunks.items():
+        source = PNGStorage(state_dir, width, height, palette)
+        target = RegionStorage(state_dir, width, height, palette, size=size)
+        for x, y in origins:
+            if target.has(x, y):
+                skipped += 1
+                continue
+            target.write(x, y, source.read(x, y))
+            imported += 1
+        target.close()
+        if delete:
+            # only once every chunk of this size is safely in its region
+            for x, y in origins:
+                os.remove(source.get_filename(x, y))
+    return imported, skipped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = commands.add_parser("migrate", help="pack a state directory's PNG chunks into region files")
+    migrate_parser.add_argument("state_dir")
+    migrate_parser.add_argument("--region-size", type=int, default=32, help="chunks per region side")
+    migrate_parser.add_argument("--delete", action="store_true", help="remove the PNG chunks once imported")
+    info_parser = commands.add_parser("info", help="print what a region file holds")
+    info_parser.add_argument("filename")
+    args = parser.parse_args(argv)
+
+    if args.command == "migrate":
+        imported, skipped = migrate(args.state_dir, size=args.region_size, delete=args.delete)
+        print("imported {} chunks, skipped {} already in a region".format(imported, skipped))
+    else:
+        if not os.path.exists(args.filename):
+            parser.error("no such region file: {}".format(args.filename))
+        with open(args.filename, "rb") as f:
+            _, version, size, width, height, _ = _HEADER.unpack(f.read(_HEADER.size))
+        region = RegionFile(args.filename, size, width, height)
+        print("version {}, {}x{} chunks of {}x{} cells".format(version, size, size, width, height))
+        print("{} chunks stored, {} bytes unused".format(len(region.chunks()), region.unused_bytes()))
+        region.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import ctypes
+from contextlib import contextmanager
+
+import numpy as np
+import pyglet
+from pyglet import gl
+
+from voxels.mesh import FRAMES_PER_VOXEL, quad_arrays
+from voxels.palette import default_palette
+
+
+class VoxelAtlas(object):
+    """Every material's frame strip packed into one texture, with per-frame tex_coords and average colours"""
+    _instances = {}
+
+    def __init__(self, palette):
+        self.palette = palette
+        strips = [pyglet.resource.image(cls.voxels_image_path).get_image_data() for cls in palette.voxel_classes[1:]]
+        strip_width = max(strip.width for strip in strips)
+        strip_height = max(strip.height for strip in strips)
+
+        self.texture = pyglet.image.Texture.create(strip_width, strip_height * len(strips),
+                                                   min_filter=gl.GL_NEAREST, mag_filter=gl.GL_NEAREST)
+        self.tex_coords = np.zeros((len(palette), FRAMES_PER_VOXEL, 12), dtype=np.float32)
+        self.colors = np.zeros((len(palette), 4), dtype=np.uint8)
+        for row, strip in enumerate(strips):
+            self.texture.blit_into(strip, 0, row * strip_height, 0)
+            frame_width = strip.width // FRAMES_PER_VOXEL
+            for frame in range(FRAMES_PER_VOXEL):
+                region = self.texture.get_region(frame * frame_width, row * strip_height, frame_width, strip.height)
+                self.tex_coords[row + 1, frame] = region.tex_coords
+
+            pixels = np.frombuffer(strip.get_data("RGBA", strip.width * 4), dtype=np.uint8)
+            filled = pixels.reshape(strip.height, strip.width, 4)[:, -frame_width:].reshape(-1, 4).astype(float)
+            alpha = filled[:, 3:] / 255.
+            if alpha.sum():
+                self.colors[row + 1, :3] = (filled[:, :3] * alpha).sum(axis=0) / alpha.sum()
+                self.colors[row + 1, 3] = 255
+
+        self.group = pyglet.graphics.TextureGroup(self.texture)
+
+    @classmethod
+    def get(cls, palette=None):
+        palette = palette or default_palette()
+        if palette not in cls._instances:
+            cls._instances[palette] = cls(palette)
+        return cls._instances[palette]
+
+
+class TileMesh(object):
+    """One indexed vertex list holding every voxel quad of a grid, textured from the shared atlas"""
+
+    def __init__(self, x, y, batch, palette=None):
+        self.x = x
+        self.y = y
+        self.batch = batch
+        self.atlas = VoxelAtlas.get(palette)
+        self._vertex_list = None
+
+    def update(self, tile_material, tile_shape):
+        self.upload(quad_arrays(self.x, self.y, tile_material, tile_shape, self.atlas.tex_coords))
+
+    def upload(self, quads):
+        """Replace the vertex list with prebuilt (vertices, tex_coords, indices) arrays"""
+        self.delete()
+        vertices, tex_coords, indices = quads
+        count = len(vertices) // 8
+        if not count:
+            return
+
+        self._vertex_list = self.batch.add_indexed(count * 4, gl.GL_TRIANGLES, self.atlas.group, indices.tolist(),
+                                                   ('v2f/static', vertices.tolist()),
+                                                   ('t3f/static', tex_coords.tolist()))
+
+    def delete(self):
+        if self._vertex_list is not None:
+            self._vertex_list.delete()
+            self._vertex_list = None
+
+
+@contextmanager
+def render_to_texture(texture, left, bottom, right, top):
+    """Draw into `texture` with the world rectangle (left, bottom, right, top) filling it, restoring GL state"""
+    framebuffer = gl.GLuint()
+    gl.glGenFramebuffers(1, ctypes.byref(framebuffer))
+    previous = gl.GLint()
+    gl.glGetIntegerv(gl.GL_FRAMEBUFFER_BINDING, ctypes.byref(previous))
+    viewport = (gl.GLint * 4)()
+    gl.glGetIntegerv(gl.GL_VIEWPORT, viewport)
+    clear_color = (gl.GLfloat * 4)()
+    gl.glGetFloatv(gl.GL_COLOR_CLEAR_VALUE, clear_color)
+
+    gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, framebuffer)
+    gl.glFramebufferTexture2D(gl.GL_FRAMEBUFFER, gl.GL_COLOR_ATTACHMENT0, texture.target, texture.id, 0)
+    gl.glViewport(0, 0, texture.width, texture.height)
+    gl.glMatrixMode(gl.GL_PROJECTION)
+    gl.glPushMatrix()
+    gl.glLoadIdentity()
+    gl.glOrtho(left, right, bottom, top, -1, 1)
+    gl.glMatrixMode(gl.GL_MODELVIEW)
+    gl.glPushMatrix()
+    gl.glLoadIdentity()
+    gl.glClearColor(0, 0, 0, 0)
+    gl.glClear(gl.GL_COLOR_BUFFER_BIT)
+    # keep the texture's alpha what it would be on screen, so drawing it back blends the same way
+    gl.glBlendFuncSeparate(gl.GL_SRC_ALPHA, gl.GL_ONE_MINUS_SRC_ALPHA, gl.GL_ONE, gl.GL_ONE_MINUS_SRC_ALPHA)
+    try:
+        yield texture
+    finally:
+        gl.glBlendFunc(gl.GL_SRC_ALPHA, gl.GL_ONE_MINUS_SRC_ALPHA)
+        gl.glClearColor(*clear_color)
+        gl.glPopMatrix()
+        gl.glMatrixMode(gl.GL_PROJECTION)
+        gl.glPopMatrix()
+        gl.glMatrixMode(gl.GL_MODELVIEW)
+        gl.glViewport(*viewport)
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, previous.value)
+        gl.glDeleteFramebuffers(1, ctypes.byref(framebuffer))
+
+
+class BakedQuad(object):
+    """A texture drawn as one quad over a world rectangle, rendered from a batch or uploaded from an array"""
+
+    def __init__(self, width, height, left, bottom, right, top):
+        self.bounds = left, bottom, right, top
+        self.texture = pyglet.image.Texture.create(width, height, min_filter=gl.GL_NEAREST,
+                                                   mag_filter=gl.GL_NEAREST)
+        # neighbouring quads must not sample each other's edges
+        gl.glBindTexture(self.texture.target, self.texture.id)
+        gl.glTexParameteri(self.texture.target, gl.GL_TEXTURE_WRAP_S, gl.GL_CLAMP_TO_EDGE)
+        gl.glTexParameteri(self.texture.target, gl.GL_TEXTURE_WRAP_T, gl.GL_CLAMP_TO_EDGE)
+        self.revision = None
+        self._vertex_list = pyglet.graphics.vertex_list(4, ('v2f/static', (left, bottom, right, bottom,
+                                                                           right, top, left, top)),
+                                                        ('t3f/static', self.texture.tex_coords))
+
+    def render(self, batch):
+        with render_to_texture(self.texture, *self.bounds):
+            batch.draw()
+
+    def upload(self, pixels):
+        """Replace the texture with a (height, width, 4) uint8 RGBA array, bottom row first"""
+        height, width = pixels.shape[:2]
+        image = pyglet.image.ImageData(width, height, "RGBA", np.ascontiguousarray(pixels).tobytes())
+        self.texture.blit_into(image, 0, 0, 0)
+
+    def draw(self):
+        gl.glEnable(self.texture.target)
+        gl.glBindTexture(self.texture.target, self.texture.id)
+        self._vertex_list.draw(gl.GL_QUADS)
+
+    def delete(self):
+        self._vertex_list.delete()
+        # pyglet frees the GL texture once nothing references it
+        self.texture = None
@@ -0,0 +1,94 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bubblestash.profiler import profiler
+from voxels.mesh import build_geometry
+from voxels.voxel import VOXEL_SIZE
+
+
+class RebuildScheduler(object):
+    """Queue of dirty grids rebuilt under a per-frame time budget, visible and nearest first"""
+
+    def __init__(self, budget=0.004, workers=2):
+        self.budget = budget
+        self.rebuilds = 0
+        self.max_in_flight = workers * 2
+        self._executor = ThreadPoolExecutor(max_workers=workers) if workers else None
+        self._pending = {}
+        self._building = {}
+
+    def __len__(self):
+        return len(self._pending) + len(self._building)
+
+    def queue(self, grid):
+        self._pending[id(grid)] = grid
+
+    def discard(self, grid):
+        self._pending.pop(id(grid), None)
+        self._building.pop(id(grid), None)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def flush(self):
+        """Finish every queued and in-flight rebuild right now, regardless of the budget"""
+        while len(self):
+            for key, (grid, future) in list(self._building.items()):
+                del self._building[key]
+                grid.apply_geometry(future.result())
+            for key, grid in list(self._pending.items()):
+                if self._pending.pop(key, None) is not None and grid.needs_rebuild:
+                    grid.update_sprite_cache()
+
+    def run(self, focus, visible=()):
+        """Rebuild queued grids around `focus` (world pixels) until the budget is spent"""
+        with profiler.phase("rebuild"):
+            self._run(focus, visible)
+        profiler.add("rebuilds", self.rebuilds)
+        return self.rebuilds
+
+    def _run(self, focus, visible):
+        self.rebuilds = 0
+        start = time.perf_counter()
+
+        def spent():
+            return self.rebuilds and time.perf_counter() - start >= self.budget
+
+        for key, (grid, future) in list(self._building.items()):
+            if spent():
+                break
+            if future.done():
+                del self._building[key]
+                grid.apply_geometry(future.result())
+                self.rebuilds += 1
+
+        if not self._pending:
+            return
+
+        focus_x, focus_y = focus
+        visible = {id(grid) for grid in visible}
+
+        def priority(grid):
+            dx = (grid.x + grid.width / 2) * VOXEL_SIZE - focus_x
+            dy = (grid.y + grid.height / 2) * VOXEL_SIZE - focus_y
+            return id(grid) not in visible, dx * dx + dy * dy
+
+        for grid in sorted(self._pending.values(), key=priority):
+            key = id(grid)
+            if key not in self._pending:
+                # discarded by an eviction that an earlier rebuild's halo lookup triggered
+                continue
+            if key in self._building:
+                # edits that landed mid-build wait until the build is applied
+                continue
+            if grid.dirty and self._executor is not None and len(self._building) < self.max_in_flight:
+                del self._pending[key]
+                self._building[key] = grid, self._executor.submit(build_geometry, *grid.prepare_build())
+                continue
+            if spent():
+                break
+            del self._pending[key]
+            if grid.needs_rebuild:
+                grid.update_sprite_cache()
+                self.rebuilds += 1
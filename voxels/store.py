@@ -1,12 +1,23 @@
 import os
-from functools import lru_cache
+import queue
+import random
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import pyglet
 
+from bubblestash.profiler import profiler
+from voxels.cache import ChunkCache
+from voxels.edit import TerrainEditor
 from voxels.grid import VoxelGrid
-from voxels.perlin import generate_random_map
-from voxels.voxel import EMPTY_VOXEL
+from voxels.palette import default_palette
+from voxels.perlin import NoiseGenerator, generate_random_map
+from voxels.physics import PhysicsLOD
+from voxels.region import RegionStorage
+from voxels.scheduler import RebuildScheduler
+from voxels.uniform import compact_state, state_nbytes
+from voxels.voxel import VOXEL_SIZE
 
 
 class VoxelGridProxy(VoxelGrid):
@@ -16,70 +27,327 @@ class VoxelGridProxy(VoxelGrid):
 
     @property
     def neighbor_x(self):
-        return self.store[self.x + self.width, self.y]
+        return self.store.get_neighbor(self.x + self.width, self.y)
 
     @property
     def neighbor_y(self):
-        return self.store[self.x, self.y + self.height]
+        return self.store.get_neighbor(self.x, self.y + self.height)
 
+    def own_state(self):
+        shared = not self.state.flags.writeable
+        state = super().own_state()
+        if shared and self.store._cache.peek((self.x, self.y)) is self:
+            # the cache measured the shared state as free, the copy isn't
+            self.store._cache.resize((self.x, self.y))
+        return state
 
-class VoxelGridStore(object):
+    def get_halo_state(self):
+        # the halo comes from the store's edge strips, so rebuilding this chunk never loads another
+        height, width = self.state.shape[:2]
+        padded = np.zeros((height + 1, width + 1), dtype=np.uint8)
+        padded[:height, :width] = self.state
+        column, row, corner = self.store.get_halo(self.x, self.y)
+        padded[:height, width] = column[:height]
+        padded[height, :width] = row[:width]
+        padded[height, width] = corner
+        return padded
 
-    def __init__(self, space, state_dir="./data/state", grid_width=8, grid_height=8, known_voxels=None,
-                 base_voxel=None):
-        self._cache = {}
-        self.space = space
+
+class PNGStorage(object):
+    """VoxelGridStore chunks kept as one `x_y_w_h.png` per chunk, coloured by material"""
+
+    def __init__(self, state_dir, grid_width=8, grid_height=8, palette=None):
         self.state_dir = state_dir
         self.grid_width = grid_width
         self.grid_height = grid_height
-        self.known_voxels = known_voxels or []
-        self.base_voxel = base_voxel or EMPTY_VOXEL
+        self.palette = palette or default_palette()
 
-    def _get_filename(self, x, y):
+    def get_filename(self, x, y):
         filename = "{}_{}_{}_{}.png".format(x, y, self.grid_width, self.grid_height)
         return os.path.join(self.state_dir, filename)
 
-    @lru_cache(1024)
+    def has(self, x, y):
+        return os.path.exists(self.get_filename(x, y))
+
+    def read(self, x, y):
+        if not self.has(x, y):
+            return None
+        image = pyglet.image.load(self.get_filename(x, y)).get_image_data()
+        state = np.frombuffer(image.get_data("BGR", image.width * 3), dtype=np.uint8)
+        return self.palette.from_colors(state.reshape([image.height, image.width, 3]))
+
+    def write(self, x, y, state):
+        height, width = state.shape[:2]
+        os.makedirs(self.state_dir, exist_ok=True)
+        data = np.ascontiguousarray(self.palette.to_colors(state)).tobytes()
+        filename = self.get_filename(x, y)
+        # write beside the target and swap it in so a crash never leaves a half-written chunk behind
+        fd, temp_filename = tempfile.mkstemp(suffix=".tmp", dir=self.state_dir)
+        with os.fdopen(fd, "wb") as f:
+            pyglet.image.ImageData(width, height, "BGR", data).save(filename, file=f)
+        os.replace(temp_filename, filename)
+
+    def close(self):
+        pass
+
+
+class VoxelGridStore(TerrainEditor, PhysicsLOD):
+    """Unbounded generated terrain, loaded on demand and saved to region files (or PNGs) when evicted"""
+
+    def __init__(self, space, state_dir="./data/state", grid_width=8, grid_height=8, known_voxels=None,
+                 base_voxel=None, tilemap=True, streaming=False, workers=2, prefetch=1, prefetch_ahead=2,
+                 build_budget=0.004, capacity=1024, max_bytes=None, palette=None, seed=None,
+                 octaves=1, scheduler=None, collision_radius=None, collision_margin=4, edge_capacity=65536,
+                 storage="region", region_size=32):
+        self._cache = ChunkCache(capacity=capacity, max_bytes=max_bytes, sizeof=lambda grid: state_nbytes(grid.state),
+                                 on_evict=self._evict)
+        self.space = space
+        self.state_dir = state_dir
+        self.grid_width = grid_width
+        self.grid_height = grid_height
+        self.known_voxels = known_voxels or {}
+        self.base_voxel = base_voxel
+        self.palette = palette or default_palette()
+        if storage == "region":
+            self.storage = RegionStorage(state_dir, grid_width, grid_height, self.palette, size=region_size)
+        elif storage == "png":
+            self.storage = PNGStorage(state_dir, grid_width, grid_height, self.palette)
+        else:
+            raise ValueError("unknown chunk storage {!r}".format(storage))
+        self.seed = seed if seed is not None else random.randint(0, 2 ** 32 - 1)
+        self.noise = NoiseGenerator(seed=self.seed, octaves=octaves)
+        self.tilemap = tilemap
+        self.collision_radius = collision_radius
+        self.collision_margin = collision_margin
+        # first column and bottom row of chunks that aren't loaded, all a neighbour's halo needs of them
+        self._edges = ChunkCache(capacity=edge_capacity)
+        # chunks a neighbour was built without, because they were still on disk while streaming
+        self._missing_edges = set()
+
+        self.scheduler = scheduler or RebuildScheduler(budget=build_budget)
+
+        # streaming mode: chunk state is loaded or generated by a worker pool and handed back through
+        # `_ready`, where draw() turns it into grids for the scheduler to build
+        self.streaming = streaming
+        self.prefetch = prefetch
+        self.prefetch_ahead = prefetch_ahead
+        self._executor = ThreadPoolExecutor(max_workers=workers) if streaming else None
+        self._pending = {}
+        self._ready = queue.Queue()
+        # chunks physics asked for since the last prefetch, kept queued even when off screen
+        self._physics_requests = set()
+        self._last_center = None
+
     def __getitem__(self, item):
         x, y = item
         grid = self._cache.get((x, y))
         if not grid:
-            filename = self._get_filename(x, y)
-            if os.path.exists(filename):
-                image = pyglet.image.load(filename).get_image_data()
-                state = np.frombuffer(image.get_data("BGR"), dtype=np.uint8).reshape([image.height, image.width, 3])
-            else:
-                state = self.gen_state(x, y)
-                self[x, y] = state
-
-            grid = VoxelGridProxy(store=self, x=x, y=y, width=self.grid_width, height=self.grid_height, state=state,
-                                  space=self.space)
-            self._cache[(x, y)] = grid
+            with profiler.phase("chunk_load"):
+                future = self._pending.pop((x, y), None)
+                state = future.result() if future is not None else self._load_state(x, y)
+                grid = self._materialise(x, y, state)
+            profiler.add("chunks_loaded")
         return grid
 
     def __setitem__(self, item, value):
         x, y = item
-        filename = self._get_filename(x, y)
-        cv2.imwrite(filename, value)
+        self.storage.write(x, y, value)
 
-    def gen_state(self, x, y):
-        return generate_random_map(self.grid_width, self.grid_height, self.known_voxels, base_voxel=self.base_voxel)
+    def has_state(self, x, y):
+        return self.storage.has(x, y)
 
-    def draw(self, camera):
-        cam_left, cam_right, cam_bottom, cam_top = camera.scaled_bounds()
-        grid_x_start = (cam_left // 32 - 1) // self.grid_width * self.grid_width
-        grid_x_end = cam_right // 32 // self.grid_width * self.grid_width
+    def _read_state(self, x, y):
+        return self.storage.read(x, y)
 
-        grid_y_start = (cam_bottom // 32 - 1) // self.grid_width * self.grid_width
-        grid_y_end = cam_top // 32 // self.grid_width * self.grid_width
+    def _load_state(self, x, y):
+        if self.has_state(x, y):
+            state = self._read_state(x, y)
+        else:
+            state = self.gen_state(x, y)
+            self[x, y] = state
+        # all-air and all-one-material chunks share a single read-only state until they are edited
+        return compact_state(state)
 
-        padding_x = self.grid_width * 2
-        padding_y = self.grid_height * 2
+    def _materialise(self, x, y, state):
+        grid = VoxelGridProxy(store=self, x=x, y=y, width=self.grid_width, height=self.grid_height, state=state,
+                              space=self.space, tilemap=self.tilemap,
+                              palette=self.palette, scheduler=self.scheduler, collision=not self.physics_lod)
+        self._cache[(x, y)] = grid
+        self._edges.pop((x, y))
+        if (x, y) in self._missing_edges:
+            # grids built before this one saw it as an empty placeholder in their halo
+            self._missing_edges.discard((x, y))
+            left = self._cache.peek((x - self.grid_width, y))
+            if left is not None:
+                for _y in range(y, y + self.grid_height):
+                    left.mark_dirty(x - 1, _y)
+            below = self._cache.peek((x, y - self.grid_height))
+            if below is not None:
+                for _x in range(x, x + self.grid_width):
+                    below.mark_dirty(_x, y - 1)
+            corner = self._cache.peek((x - self.grid_width, y - self.grid_height))
+            if corner is not None:
+                corner.mark_dirty(x - 1, y - 1)
+        return grid
+
+    def _evict(self, key, grid):
+        if grid.modified:
+            self[key] = grid.state
+            grid.modified = False
+        self._edges[key] = grid.state[:, 0].copy(), grid.state[0, :].copy()
+        if self._collision_grids:
+            self._collision_grids.pop(id(grid), None)
+        grid.delete()
+
+    def flush(self):
+        """Write every edited chunk back to disk without evicting it"""
+        for key in self._cache:
+            grid = self._cache.peek(key)
+            if grid.modified:
+                self[key] = grid.state
+                grid.modified = False
+
+    def stats(self):
+        return self._cache.stats()
+
+    def get_neighbor(self, x, y):
+        """Grid at chunk origin (x, y) if it is loaded, otherwise None; never loads it"""
+        return self._cache.peek((x, y))
+
+    def get_edges(self, x, y):
+        """(first column, bottom row) of chunk (x, y) without loading it, or None while it is still on disk"""
+        grid = self._cache.peek((x, y))
+        if grid is not None:
+            return grid.state[:, 0], grid.state[0, :]
+        edges = self._edges.get((x, y))
+        if edges is None:
+            if not self.has_state(x, y):
+                edges = self.gen_state(x, y, width=1)[:, 0], self.gen_state(x, y, height=1)[0, :]
+            elif self.streaming:
+                self._missing_edges.add((x, y))
+                return None
+            else:
+                state = self._read_state(x, y)
+                edges = state[:, 0].copy(), state[0, :].copy()
+            self._edges[(x, y)] = edges
+        return edges
+
+    def get_halo(self, x, y):
+        """Right neighbour's first column, upper neighbour's bottom row and the diagonal corner cell"""
+        empty_column = np.zeros(self.grid_height, dtype=np.uint8)
+        empty_row = np.zeros(self.grid_width, dtype=np.uint8)
+        right = self.get_edges(x + self.grid_width, y) or (empty_column, empty_row)
+        above = self.get_edges(x, y + self.grid_height) or (empty_column, empty_row)
+        corner = self.get_edges(x + self.grid_width, y + self.grid_height) or (empty_column, empty_row)
+        return right[0], above[1], corner[0][0]
+
+    def _commit(self, grids):
+        # anything evicted mid-transaction has already been written back and released
+        super()._commit([grid for grid in grids if self._cache.peek((grid.x, grid.y)) is grid])
+
+    def grids_in_rect(self, left, bottom, right, top):
+        """Grids overlapping the inclusive cell rectangle, loading any that are not in memory yet"""
+        for y in range(int(bottom) // self.grid_height * self.grid_height, int(top) + 1, self.grid_height):
+            for x in range(int(left) // self.grid_width * self.grid_width, int(right) + 1, self.grid_width):
+                yield self[x, y]
+
+    def _collision_grids_in_rect(self, left, bottom, right, top):
+        if not self.streaming:
+            return self.grids_in_rect(left, bottom, right, top)
+        # never stall the frame on a load for physics; chunks still on their way get collision next frame
         grids = []
-        for y in range(grid_y_start - padding_y, grid_y_end + padding_y, self.grid_height):
-            for x in range(grid_x_start - padding_x, grid_x_end + padding_x, self.grid_width):
-                grid = self[x, y]
-                grids.append(grid)
+        for y in range(int(bottom) // self.grid_height * self.grid_height, int(top) + 1, self.grid_height):
+            for x in range(int(left) // self.grid_width * self.grid_width, int(right) + 1, self.grid_width):
+                grid = self._cache.peek((x, y))
+                if grid is None:
+                    self.request(x, y)
+                    self._physics_requests.add((x, y))
+                else:
+                    grids.append(grid)
+        return grids
+
+    def gen_state(self, x, y, width=None, height=None):
+        """Generate chunk (x, y), or just its first `width` columns / `height` rows"""
+        return generate_random_map(width or self.grid_width, height or self.grid_height, self.known_voxels,
+                                   base_voxel=self.base_voxel, palette=self.palette, origin=(x, y), noise=self.noise,
+                                   scale=5 / self.grid_width)
+
+    def _chunk_range(self, camera, padding=2):
+        cam_left, cam_right, cam_bottom, cam_top = camera.scaled_bounds() // VOXEL_SIZE
+        x_start = int((cam_left - 1) // self.grid_width - padding) * self.grid_width
+        x_end = int(cam_right // self.grid_width + padding) * self.grid_width
+        y_start = int((cam_bottom - 1) // self.grid_height - padding) * self.grid_height
+        y_end = int(cam_top // self.grid_height + padding) * self.grid_height
+        return range(x_start, x_end, self.grid_width), range(y_start, y_end, self.grid_height)
+
+    def request(self, x, y):
+        """Queue chunk (x, y) for background loading unless it is already loaded or on its way"""
+        if (x, y) in self._cache or (x, y) in self._pending:
+            return
+        future = self._executor.submit(self._load_state, x, y)
+        self._pending[(x, y)] = future
+        future.add_done_callback(lambda f: self._ready.put((x, y, f)))
+
+    def _prefetch(self, camera, xs, ys):
+        center = camera.center()
+        dx, dy = (0, 0) if self._last_center is None else np.sign(np.subtract(center, self._last_center))
+        self._last_center = center
+
+        # widen the visible range into a ring, reaching further ahead in the direction the camera moves
+        ring_x = self.prefetch + self.prefetch_ahead * max(-dx, 0), self.prefetch + self.prefetch_ahead * max(dx, 0)
+        ring_y = self.prefetch + self.prefetch_ahead * max(-dy, 0), self.prefetch + self.prefetch_ahead * max(dy, 0)
+        xs = range(xs.start - int(ring_x[0]) * self.grid_width, xs.stop + int(ring_x[1]) * self.grid_width,
+                   self.grid_width)
+        ys = range(ys.start - int(ring_y[0]) * self.grid_height, ys.stop + int(ring_y[1]) * self.grid_height,
+                   self.grid_height)
+
+        center_x, center_y = center[0] / VOXEL_SIZE, center[1] / VOXEL_SIZE
+        chunks = sorted(((x, y) for y in ys for x in xs),
+                        key=lambda c: (c[0] + self.grid_width / 2 - center_x) ** 2 +
+                                      (c[1] + self.grid_height / 2 - center_y) ** 2)
+        for x, y in chunks:
+            self.request(x, y)
+
+        # loads queued for chunks the camera has since moved away from would only hold up the ones it needs
+        wanted = set(chunks) | self._physics_requests
+        self._physics_requests = set()
+        for key, future in list(self._pending.items()):
+            if key not in wanted and future.cancel():
+                del self._pending[key]
+
+    def _build_ready(self):
+        """Turn finished chunk states into grids; building their geometry is left to the scheduler"""
+        while True:
+            try:
+                x, y, future = self._ready.get_nowait()
+            except queue.Empty:
+                break
+            if self._pending.get((x, y)) is not future:
+                continue
+            del self._pending[x, y]
+            with profiler.phase("chunk_load"):
+                self._materialise(x, y, future.result())
+            profiler.add("chunks_loaded")
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self.scheduler.close()
+        self._cache.clear()
+        self.storage.close()
+
+    def draw(self, camera, focus=None):
+        xs, ys = self._chunk_range(camera)
+        # grids with live collision are pinned too, so nothing a body stands on is evicted under it
+        self._cache.pinned = {(x, y) for y in ys for x in xs} | {(grid.x, grid.y) for grid in self.collision_grids()}
+        if self.streaming:
+            self._prefetch(camera, xs, ys)
+            self._build_ready()
+            grids = [self._cache.get((x, y)) for y in ys for x in xs if (x, y) in self._cache]
+        else:
+            grids = [self[x, y] for y in ys for x in xs]
 
-        for grid in grids:
-            grid.draw()
+        self.scheduler.run(focus or camera.center(), visible=grids)
+        with profiler.phase("draw_terrain"):
+            for grid in grids:
+                grid.draw()
@@ -0,0 +1,39 @@
+"""Shared read-only state for chunks filled with a single material"""
+import numpy as np
+
+# one byte per material for every shared state to point into
+_MATERIALS = np.arange(256, dtype=np.uint8)
+_MATERIALS.flags.writeable = False
+
+
+def shared_state(material, shape):
+    return np.broadcast_to(_MATERIALS[material:material + 1].reshape(1, 1), shape)
+
+
+def is_shared(state):
+    return state.base is not None and not state.flags.writeable and not any(state.strides)
+
+
+def uniform_material(state):
+    """Material filling every cell of `state`, or None if it holds more than one (or none)"""
+    if not state.size:
+        return None
+    if is_shared(state):
+        return int(state[0, 0])
+    first = state.flat[0]
+    if (state == first).all():
+        return int(first)
+    return None
+
+
+def compact_state(state):
+    """`state` itself, or the shared stand-in for it if every cell holds the same material"""
+    material = uniform_material(state)
+    if material is None:
+        return state
+    return shared_state(material, state.shape)
+
+
+def state_nbytes(state):
+    """Memory actually held by `state`; shared states hold none of their own"""
+    return 0 if is_shared(state) else state.nbytes
@@ -1,10 +1,8 @@
 import numpy as np
 import pyglet
-import pymunk
-
-from bubblestash.actor import Actor
 
 EMPTY_VOXEL = (255, 255, 255)
+VOXEL_SIZE = 32
 
 def walk_segments(vertices):
     length = len(vertices)
@@ -78,7 +76,7 @@ VOXEL_SEGMENTS = {
 }
 
 
-class Voxel(Actor):
+class Voxel(pyglet.sprite.Sprite):
     _voxels_by_color = {}
     color = None
     voxels_image_path = None
@@ -91,22 +89,7 @@ class Voxel(Actor):
 
         self.value = value
         self.shape_value = shape_value
-
-        body = pymunk.Body(body_type=pymunk.Body.STATIC, moment=10000)
-
-        vertices = VOXEL_SEGMENTS.get(shape_value)
-        print(shape_value, vertices)
-        segments = []
-        if vertices:
-            for a,b in vertices:
-                print(a, b)
-                segment = pymunk.Segment(body, a, b, 3)
-                segment.elasticity = .1
-                segment.friction = 0.7
-                segment.collision_type = 0b00000001
-                segments.append(segment)
-        super().__init__(body=body, shape=segments, img=self._voxels_sequence[self.shape_value], x=x * 32, y=y * 32,
-                         **kwargs)
+        super().__init__(img=self._voxels_sequence[self.shape_value], x=x * VOXEL_SIZE, y=y * VOXEL_SIZE, **kwargs)
 
     @classmethod
     def by_color(cls, color, x, y, value=0, shape_value=0, **kwargs):